@@ -2,5 +2,18 @@
 The scriptuit package is a platform for BASH pipeline generation.
 """
 
+__version__ = '0.1.0'
+
 from . import utilities
 from . import docopt
+from . import bench
+from . import estimate
+from . import jobs
+from . import locks
+from . import logs
+from . import metrics
+from . import nifti
+from . import schedule
+from . import sweep
+from . import watch
+from . import workqueue
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""
+A micro-benchmark harness for scriptuit modules. Each repetition builds a
+fresh sandboxed subject (synthetic or copied from a template), runs the module
+with fixed argument values, and records wall time, CPU time, max RSS and the
+bytes read and written by the module and everything it runs.
+"""
+
+import os
+import time
+import math
+import shutil
+import struct
+import tempfile
+import subprocess
+
+from scriptuit import utilities
+
+METRICS = ['wall', 'user', 'sys', 'maxrss', 'rchar', 'wchar',
+           'read_bytes', 'write_bytes']
+
+def get_module_spec(filename):
+    """
+    Reads a module header. Returns a dict with the module's arguments, their
+    option types (obtained with get_opts()), and its output prefixes.
+    """
+    name = os.path.basename(filename)
+    header = utilities.get_header(filename)
+    args = utilities.get_line(header, name) or []
+
+    return {'name': name,
+            'args': args,
+            'options': dict(utilities.get_opts(header, args) or []),
+            'output': utilities.get_line(header, 'output:'),
+            'others': utilities.get_line(header, 'others:')}
+
+def get_values(spec, values=[], prefix='bench_input'):
+    """
+    Returns the argument values to run the module with: those supplied, then
+    defaults for the remaining arguments. The input argument is the prefix of
+    the synthetic inputs, list options take the first choice, and numbers are
+    1.
+    """
+    values = list(values)
+    for arg in spec['args'][len(values):]:
+        opt = spec['options'].get(arg, '')
+        if arg.lower() == 'input' or opt.startswith('list: input'):
+            values.append(prefix)
+        elif opt.startswith('list'):
+            values.append(filter(lambda x: x != '?', opt.split(':')[1].split())[0])
+        elif opt.startswith('float'):
+            values.append('1.0')
+        else:
+            values.append('1')
+
+    return values
+
+def write_nifti(filename, dims):
+    """
+    Writes an uncompressed int16 NIFTI-1 file of the given dims, filled with
+    random data.
+    """
+    header = bytearray(352)
+    struct.pack_into('<i', header, 0, 348)
+    struct.pack_into('<8h', header, 40, *([len(dims)] + list(dims) + [1] * (7 - len(dims))))
+    struct.pack_into('<2h', header, 70, 4, 16)
+    struct.pack_into('<8f', header, 76, *([1.0] * 8))
+    struct.pack_into('<f', header, 108, 352.0)
+    header[344:348] = 'n+1\0'
+
+    n_bytes = 2
+    for d in dims:
+        n_bytes *= d
+
+    f = open(filename, 'wb')
+    f.write(header)
+    while n_bytes > 0:
+        f.write(os.urandom(min(n_bytes, 2**20)))
+        n_bytes -= 2**20
+    f.close()
+
+def make_sandbox(root, mode, ID, n_sess=1, n_runs=1, dims=[64, 64, 32, 100],
+                 prefix='bench_input', template=None):
+    """
+    Builds an experiment BENCH with one subject SUBJ in root/data. Either the
+    template subject folder is copied, or each RUN folder is given a synthetic
+    NIFTI, and each session folder a copy named by the scriptuit convention
+    (<prefix>.<ID>.<run>.nii) for modules taking an input prefix.
+    """
+    dir_subj = os.path.join(root, 'data', 'BENCH', 'SUBJ')
+
+    if template:
+        shutil.copytree(template, dir_subj, symlinks=True)
+        return os.path.join(root, 'data')
+
+    for s in range(n_sess):
+        dir_sess = os.path.join(dir_subj, mode, 'SESS%02d' % (s+1))
+        for r in range(n_runs):
+            dir_run = os.path.join(dir_sess, 'RUN%02d' % (r+1))
+            os.makedirs(dir_run)
+            write_nifti(os.path.join(dir_run, 'bench.nii'), dims)
+            shutil.copy(os.path.join(dir_run, 'bench.nii'),
+                        os.path.join(dir_sess, '{}.{}.%02d.nii'.format(prefix, ID) % (r+1)))
+
+    return os.path.join(root, 'data')
+
+def read_io():
+    """
+    Returns the I/O counters of this process, which include those of every
+    child that has been waited for. Returns zeros if /proc is unavailable.
+    """
+    io = dict((k, 0) for k in ['rchar', 'wchar', 'read_bytes', 'write_bytes'])
+    try:
+        for line in open('/proc/self/io'):
+            key, value = line.split(':')
+            if key in io:
+                io[key] = int(value)
+    except IOError:
+        pass
+
+    return io
+
+def run_module(filename, values, env, log=os.devnull):
+    """
+    Runs a module once, and returns its exit code and resource usage.
+    maxrss is in kilobytes, all other sizes are in bytes.
+    """
+    out = open(log, 'ab')
+    io = read_io()
+    start = time.time()
+
+    proc = subprocess.Popen(['bash', filename] + values, env=env,
+                                                         stdout=out,
+                                                         stderr=subprocess.STDOUT)
+    pid, status, usage = os.wait4(proc.pid, 0)
+
+    wall = time.time() - start
+    io_after = read_io()
+    out.close()
+
+    result = {'rc': os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1,
+              'wall': wall,
+              'user': usage.ru_utime,
+              'sys': usage.ru_stime,
+              'maxrss': usage.ru_maxrss}
+    for key in io:
+        result[key] = io_after[key] - io[key]
+
+    return result
+
+def bench(filename, values, n=5, mode='BENCH', n_sess=1, n_runs=1,
+          dims=[64, 64, 32, 100], template=None, log=os.devnull):
+    """
+    Runs a module n times, each in a fresh sandbox, and returns the list of
+    results (obtained with run_module()).
+    """
+    ID = 'bench'
+    results = []
+
+    for i in range(n):
+        root = tempfile.mkdtemp(prefix='scriptuit-bench-')
+        try:
+            dir_data = make_sandbox(root, mode, ID, n_sess, n_runs, dims,
+                                    template=template)
+            env = dict(os.environ)
+            env.update({'DIR_MODULES': os.path.dirname(os.path.abspath(filename)),
+                        'DIR_DATA': dir_data,
+                        'DIR_EXPT': 'BENCH',
+                        'DATA_TYPE': mode,
+                        'ID': ID,
+                        'SUB': 'SUBJ'})
+            results.append(run_module(filename, values, env, log))
+        finally:
+            shutil.rmtree(root)
+
+    return results
+
+def summarize(x):
+    """
+    Returns the number, mean, standard deviation, median, min and max of x.
+    """
+    n = len(x)
+    mean = sum(x) / float(n)
+    sd = math.sqrt(sum((v - mean)**2 for v in x) / (n - 1)) if n > 1 else 0.0
+    s = sorted(x)
+    median = s[n/2] if n % 2 == 1 else (s[n/2-1] + s[n/2]) / 2.0
+
+    return {'n': n, 'mean': mean, 'sd': sd, 'median': median,
+            'min': s[0], 'max': s[-1]}
+
+def welch(a, b):
+    """
+    Returns Welch's t statistic for the difference in the means of a and b
+    (obtained with summarize()), or None if it is undefined.
+    """
+    se = math.sqrt(a['sd']**2 / a['n'] + b['sd']**2 / b['n'])
+    if se == 0:
+        return None
+    return (b['mean'] - a['mean']) / se
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""
+Estimates the cost of running a master script over an experiment before it is
+launched: core-hours, wall time with n subjects running at once, peak disk
+per subject, and new storage, per module.
+
+Stage durations come from the stage events recorded by rendered scripts while
+SCRIPTUIT_METRICS is set, and output sizes from the subjects that already
+have a stage's outputs. Both are scaled to each subject by the bytes of its
+NIFTI inputs. Stages without recorded durations are given a default. Where
+no subject has a prefix's outputs on disk, an output: prefix is assumed to
+take as many bytes as the inputs, and an others: prefix none; such
+estimates are marked as assumed.
+"""
+
+import os
+
+from scriptuit import metrics, schedule, utilities
+
+def get_stage_durations(directory, ID=None):
+    """
+    Returns a dict of modules and the durations in seconds of their
+    successful stages, read from the events file in a metrics folder. If ID
+    is defined, a module's events with this ID are used when there are any.
+    """
+    durations, own = {}, {}
+    filename = os.path.join(directory or '', metrics.EVENTS)
+    if not directory or not os.path.isfile(filename):
+        return durations
+
+    for line in open(filename):
+        try:
+            stamp, event, labels, value = line.rstrip('\n').split('\t')
+            value = float(value)
+        except ValueError:
+            continue # partially written
+        if event != 'stage':
+            continue
+
+        labels = dict(l.split('=', 1) for l in labels.split(',') if '=' in l)
+        if 'module' not in labels:
+            continue
+        durations.setdefault(labels['module'], []).append(value)
+        if ID and labels.get('id') == ID:
+            own.setdefault(labels['module'], []).append(value)
+
+    durations.update(own)
+    return durations
+
+def get_stages(invocations, dir_modules):
+    """
+    Returns, for each invocation, its module, its output prefix (or None),
+    and every prefix it writes (output: and others:).
+    """
+    stages = []
+    for words in invocations:
+        header = utilities.get_header(os.path.join(dir_modules, words[0]))
+        output = utilities.get_line(header, 'output:') or []
+        others = utilities.get_line(header, 'others:') or []
+        stages.append([words[0], output[0] if output else None, output + others])
+
+    return stages
+
+def get_patterns(stages, dir_modules, ID):
+    """
+    Returns a dict of prefixes and the start of their file names: <prefix>.<ID>.
+    if the module names its outputs by the scriptuit convention, otherwise
+    <prefix>. (as scriptuit clean matches them, whatever the ID).
+    """
+    patterns = {}
+    for m, output, written in stages:
+        body = utilities.get_body(os.path.join(dir_modules, m))
+        for p in written:
+            if utilities.is_named_by_id(body, p):
+                patterns[p] = '{}.{}.'.format(p, ID)
+            else:
+                patterns.setdefault(p, '{}.'.format(p))
+
+    return patterns
+
+def get_outputs(directory, subj, mode, patterns):
+    """
+    Returns a dict of prefixes and the number and bytes of a subject's
+    outputs whose names start with the prefix's pattern (obtained with
+    get_patterns()), in its modality and session folders (where stages
+    write, see get_rendered_purge()).
+    """
+    outputs = dict((p, [0, 0]) for p in patterns)
+    dir_mode = os.path.join(directory, subj, mode)
+    if not os.path.isdir(dir_mode):
+        return outputs
+
+    folders = [dir_mode] + [os.path.join(dir_mode, d) for d in os.listdir(dir_mode)
+                                if os.path.isdir(os.path.join(dir_mode, d))]
+    for folder in folders:
+        for f in os.listdir(folder):
+            for p in patterns:
+                if f.startswith(patterns[p]):
+                    outputs[p][0] += 1
+                    outputs[p][1] += os.path.getsize(os.path.join(folder, f))
+
+    return outputs
+
+def get_subjects(directory, subjects, mode, patterns, n_threads=8):
+    """
+    Returns the inventory of each subject with the modality (obtained with
+    get_inventory()), with the outputs of each prefix (obtained with
+    get_outputs()) as 'written', n_threads subjects at a time.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    def inspect(subj):
+        inventory = utilities.get_inventory(directory, subj, mode)
+        inventory['written'] = get_outputs(directory, subj, mode, patterns)
+        return inventory
+
+    pool = ThreadPool(max(1, n_threads))
+    try:
+        inventories = pool.map(inspect, subjects)
+    finally:
+        pool.close()
+
+    return filter(lambda x: x['exists'], inventories)
+
+def get_ratios(inventories, prefixes):
+    """
+    Returns a dict of prefixes and the median bytes written per byte of input,
+    over the subjects with non-empty outputs (placeholders left by purged
+    stages are empty), and the number of those subjects. The ratio is None if
+    there are none.
+    """
+    ratios = {}
+    for p in prefixes:
+        x = [float(inv['written'][p][1]) / inv['bytes'] for inv in inventories
+                 if inv['written'][p][1] > 0 and inv['bytes'] > 0]
+        ratios[p] = [schedule.get_median(x) if x else None, len(x)]
+
+    return ratios
+
+def estimate(stages, inventories, durations={}, purge={}, default=600.0, cores=1):
+    """
+    Returns the estimated cost of running every stage on every subject, as a
+    list of rows (one per stage) and a dict of subjects. Each row holds the
+    module, the median stage duration (seconds) and the number of durations
+    it came from, the core-hours over all subjects, the mean bytes written
+    per subject and the fewest subjects any of its prefixes was measured on
+    (0 if any prefix is assumed), and the bytes not yet on disk that remain
+    once the pipeline finishes. A prefix written by several stages is counted
+    at the last of them, whose files are the ones left on disk. Each subject
+    holds its duration (seconds) and its peak disk use (inputs and outputs,
+    bytes).
+
+    durations is a dict of modules and stage durations (obtained with
+    get_stage_durations()), and purge a dict of stage indices and the prefixes
+    removed after them (obtained with get_purge_schedule()).
+    """
+    prefixes = sorted(set(p for stage in stages for p in stage[2]))
+    ratios = get_ratios(inventories, prefixes)
+    purged = set(p for i in purge for p in purge[i])
+    last = dict((p, i) for i, stage in enumerate(stages) for p in stage[2])
+
+    # durations and sizes scale with inputs, relative to the average subject
+    sizes = [inv['bytes'] for inv in inventories if inv['bytes']]
+    mean = sum(sizes) / float(len(sizes)) if sizes else 0
+
+    # unmeasured prefixes: the main output takes as many bytes as the inputs,
+    # others: (e.g., parameters and masks) are not counted
+    def get_bytes(inv, p, output):
+        written = inv['written'][p][1]
+        if written > 0:
+            return written
+        if ratios[p][0] is not None:
+            return ratios[p][0] * inv['bytes']
+        return inv['bytes'] if p == output else 0
+
+    rows = [{'module': m, 'time': None, 'timed': len(durations.get(m, [])),
+             'core_hours': 0.0, 'bytes': 0.0, 'new': 0.0,
+             'sized': min([ratios[p][1] for p in written] or [0])}
+            for m, output, written in stages]
+    for row in rows:
+        if row['timed']:
+            row['time'] = schedule.get_median(durations[row['module']])
+
+    subjects = {}
+    for inv in inventories:
+        scale = inv['bytes'] / mean if mean and inv['bytes'] else 1.0
+        total, present = 0.0, {}
+        disk = peak = inv['bytes']
+
+        for i, (m, output, written) in enumerate(stages):
+            t = (rows[i]['time'] if rows[i]['timed'] else default) * scale
+            total += t
+            rows[i]['core_hours'] += t * cores / 3600.0
+
+            for p in written:
+                present[p] = get_bytes(inv, p, output)
+                if last[p] != i:
+                    continue
+                rows[i]['bytes'] += present[p] / len(inventories)
+                if inv['written'][p][0] == 0 and p not in purged:
+                    rows[i]['new'] += present[p]
+            disk = inv['bytes'] + sum(present.values())
+            peak = max(peak, disk)
+
+            for p in purge.get(i, []):
+                present.pop(p, None)
+
+        subjects[inv['subject']] = {'time': total, 'peak': peak}
+
+    return rows, subjects
+
+def get_wall_time(subjects, n_slots):
+    """
+    Returns the time in seconds to run every subject with n_slots subjects
+    running at once, longest first.
+    """
+    durations = dict((s, subjects[s]['time']) for s in subjects)
+    return schedule.get_makespan(schedule.get_order(durations), durations, n_slots)
+
+def get_human_size(n):
+    """
+    Returns a number of bytes as a short string, e.g., 1.5G.
+    """
+    for unit in ['', 'K', 'M', 'G', 'T']:
+        if abs(n) < 1024 or unit == 'T':
+            return '{:.1f}{}'.format(n, unit) if unit else '{:.0f}'.format(n)
+        n /= 1024.0
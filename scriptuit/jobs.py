@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+"""
+Shared helpers for the queue submission tools (sit-queue, sit-sharc). Mostly
+for bundling many short proclist commands into a single scheduler job, keeping
+track of how long those commands took, and resubmitting jobs killed for
+exceeding their memory or walltime requests.
+"""
+
+import os
+import re
+import random
+import string
+import subprocess
+
+HISTORY = '.sit-history'
+RESOURCES = '.sit-resources'
+
+# bundles request their estimated duration times this, since estimates are
+# medians and some commands run longer
+MARGIN = 1.5
+
+# log lines showing that a job ran out of memory, or out of time
+OOM = re.compile('out of memory|oom-kill|memoryerror|bad_alloc|'
+                 'cannot allocate memory|h_vmem', re.IGNORECASE)
+TIMEOUT = re.compile('h_rt|time limit|walltime', re.IGNORECASE)
+
+# bash reports a command killed by signal n as exit code 128 + n
+SIGKILL = 137
+SIGXCPU = 152
+
+def get_uid():
+    """
+    Returns a random 6 character string. This keeps jobs submitted by multiple
+    users distinct.
+    """
+    return ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(6))
+
+def get_key(command):
+    """
+    Returns the history key of a proclist command: the basename of the script
+    it runs. Every subject run through the same script shares a key.
+    """
+    return os.path.basename(command.strip().split(' ')[0])
+
+def get_subject(command):
+    """
+    Returns the subject a proclist command runs on: the first argument passed
+    to its script, or '' if there is none.
+    """
+    words = command.strip().split()
+    if len(words) > 1:
+        return words[1]
+    return ''
+
+def read_history(filename=HISTORY):
+    """
+    Returns a dict of command keys and their recorded durations in seconds.
+    """
+    history = {}
+    if not os.path.isfile(filename):
+        return history
+
+    for line in open(filename):
+        try:
+            key, duration = line.rstrip('\n').split('\t')[:2]
+            history.setdefault(key, []).append(float(duration))
+        except ValueError:
+            continue
+
+    return history
+
+def read_subject_history(key, filename=HISTORY):
+    """
+    Returns a dict of subjects and the recorded durations in seconds of the
+    commands with this key that ran on them.
+    """
+    history = {}
+    if not os.path.isfile(filename):
+        return history
+
+    for line in open(filename):
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) < 3 or fields[0] != key or not fields[2]:
+            continue
+        try:
+            history.setdefault(fields[2], []).append(float(fields[1]))
+        except ValueError:
+            continue
+
+    return history
+
+def read_subject_times(key, filename=HISTORY):
+    """
+    Returns a dict of subjects and the [start, end] times (seconds since the
+    epoch) of the last recorded command with this key that ran on them.
+    Records written before start times were kept are skipped.
+    """
+    times = {}
+    if not os.path.isfile(filename):
+        return times
+
+    for line in open(filename):
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) < 5 or fields[0] != key or not fields[2]:
+            continue
+        try:
+            times[fields[2]] = [float(fields[3]), float(fields[4])]
+        except ValueError:
+            continue
+
+    return times
+
+def write_history(records, filename=HISTORY):
+    """
+    Appends the durations of successful commands in records (obtained with
+    read_status()) to the history file, with the subject they ran on and,
+    where known, their start and end times, as 'key seconds subject start
+    end' (tab-separated). Durations of zero (not measured) are skipped.
+    """
+    f = open(filename, 'ab')
+    for i, rc, duration, command, start in records:
+        if rc != 0 or duration <= 0:
+            continue
+        fields = [get_key(command), duration, get_subject(command)]
+        if start is not None:
+            fields += ['{:.3f}'.format(start), '{:.3f}'.format(start + duration)]
+        f.write('\t'.join(str(x) for x in fields) + '\n')
+    f.close()
+
+def get_duration(history, command, default):
+    """
+    Returns the estimated duration of a command in seconds, the median of its
+    history if there is one, and the default otherwise.
+    """
+    durations = sorted(history.get(get_key(command), [])[-50:])
+    if len(durations) == 0:
+        return default
+
+    mid = len(durations) / 2
+    if len(durations) % 2 == 1:
+        return durations[mid]
+    return (durations[mid-1] + durations[mid]) / 2.0
+
+def get_bundle_duration(commands, history, default, n_procs=1):
+    """
+    Returns the estimated duration of a bundle in seconds: the commands run
+    in order, n_procs at a time, each starting as soon as one finishes (as
+    the script written by write_bundle() runs them).
+    """
+    from scriptuit import schedule
+
+    durations = [get_duration(history, command, default) for command in commands]
+    return schedule.get_makespan(range(len(durations)), durations, n_procs)
+
+def get_bundles(commands, history, walltime, default, n_procs=1):
+    """
+    Packs commands into bundles whose estimated duration (obtained with
+    get_bundle_duration()) stays under walltime (all times in seconds).
+    Commands keep their order, and every bundle contains at least one
+    command.
+    """
+    bundles = []
+    bundle = []
+
+    for command in commands:
+        if bundle and get_bundle_duration(bundle + [command], history, default,
+                                          n_procs) > walltime:
+            bundles.append(bundle)
+            bundle = []
+        bundle.append(command)
+
+    if bundle:
+        bundles.append(bundle)
+
+    return bundles
+
+def get_walltime(commands, history, walltime, default, n_procs=1):
+    """
+    Returns the walltime in seconds to request for a bundle: its estimated
+    duration, or the target walltime if that is longer, with a margin.
+    """
+    return max(walltime, get_bundle_duration(commands, history, default, n_procs)) * MARGIN
+
+def quote(string):
+    """
+    Single-quotes a string for BASH.
+    """
+    return "'" + string.replace("'", "'\\''") + "'"
+
+def write_bundle(name, commands, n_procs=1, dir_jobs='.jobs', dir_logs='.logs'):
+    """
+    Writes a job script that runs commands, n_procs at a time. The exit code,
+    duration and start time of each command are appended to
+    <dir_jobs>/<name>.status as 'index exit seconds start command'
+    (tab-separated), and the output of each
+    command is written to <dir_logs>/<name>.<index>. The job fails if any
+    command fails. The commands are also listed in <dir_jobs>/<name>.commands.
+    """
+    script = os.path.join(dir_jobs, name)
+    status = os.path.abspath('{}.status'.format(script))
+    logs = os.path.abspath(os.path.join(dir_logs, name))
+
+    c = open('{}.commands'.format(script), 'wb')
+    f = open(script, 'wb')
+    f.write('#!/bin/bash\n\n'
+            '# scriptuit bundle {name}: {n} commands, {n_procs} at a time.\n\n'
+            'STATUS={status}\n'
+            'LOGS={logs}\n\n'
+            'sit_run() {{\n'
+            '    local t0=$(date +%s.%N)\n'
+            '    bash -c "${{2}}" > ${{LOGS}}.${{1}} 2>&1\n'
+            '    local rc=$?\n'
+            '    local t1=$(date +%s.%N)\n'
+            '    echo "scriptuit: exit ${{rc}}" >> ${{LOGS}}.${{1}}\n'
+            '    printf "%s\\t%s\\t%s\\t%s\\t%s\\n" ${{1}} ${{rc}} \\\n'
+            '        $(awk "BEGIN {{print ${{t1}} - ${{t0}}}}") ${{t0}} "${{2}}" >> ${{STATUS}}\n'
+            '}}\n\n'
+            'sit_wait() {{\n'
+            '    while [ $(jobs -rp | wc -l) -ge {n_procs} ]; do\n'
+            '        sleep 1\n'
+            '    done\n'
+            '}}\n\n'.format(name=name, n=len(commands), n_procs=n_procs,
+                            status=status, logs=logs))
+
+    for i, command in enumerate(commands):
+        f.write('sit_wait; sit_run {} {} &\n'.format(i, quote(command)))
+        c.write(command + '\n')
+
+    f.write('wait\n\n'
+            "awk -F'\\t' '$2 != 0 {n++} END {exit n > 0}' ${STATUS}\n"
+            'rc=$?\n'
+            'echo "scriptuit: exit ${rc}"\n'
+            'exit ${rc}\n')
+    f.close()
+    c.close()
+    os.chmod(script, 0755)
+
+    return script
+
+def read_status(dir_jobs='.jobs', name=None):
+    """
+    Returns the command records of every bundle in dir_jobs (or only the
+    bundle called name) as a list of [index, exit code, duration, command,
+    start], oldest bundle first (resubmitted bundles follow the original).
+    start is None in status files written before start times were kept.
+    """
+    records = []
+    if not os.path.isdir(dir_jobs):
+        return records
+
+    by_mtime = lambda f: (os.path.getmtime(os.path.join(dir_jobs, f)), f)
+    for f in sorted(os.listdir(dir_jobs), key=by_mtime):
+        if not f.endswith('.status'):
+            continue
+        if name and f != '{}.status'.format(name):
+            continue
+        for line in open(os.path.join(dir_jobs, f)):
+            fields = line.rstrip('\n').split('\t', 4)
+            try:
+                i, rc, duration = int(fields[0]), int(fields[1]), float(fields[2])
+            except (IndexError, ValueError):
+                continue
+            try:
+                start, command = float(fields[3]), fields[4]
+            except (IndexError, ValueError):
+                start, command = None, '\t'.join(fields[3:])
+            if command:
+                records.append([i, rc, duration, command, start])
+
+    return records
+
+def get_failed(dir_jobs='.jobs'):
+    """
+    Returns the commands of every bundle in dir_jobs whose last run exited
+    with an error, or that never reported an exit code (e.g., the job was
+    killed), once each. Commands that succeeded when resubmitted are not
+    returned.
+    """
+    if not os.path.isdir(dir_jobs):
+        return []
+
+    latest = {}
+    for record in read_status(dir_jobs):
+        latest[record[3]] = record[1]
+
+    failed = []
+    for f in sorted(os.listdir(dir_jobs)):
+        if not f.endswith('.commands'):
+            continue
+        for command in open(os.path.join(dir_jobs, f)).read().splitlines():
+            if latest.get(command) != 0 and command not in failed:
+                failed.append(command)
+
+    return failed
+
+def read_resources(filename=RESOURCES):
+    """
+    Returns a dict of job keys and the largest [memory (GB), walltime
+    (minutes)] requested by successful jobs with that key, so every job of a
+    kind starts with a request that was enough for the largest.
+    """
+    resources = {}
+    if not os.path.isfile(filename):
+        return resources
+
+    for line in open(filename):
+        try:
+            key, mem, walltime = line.rstrip('\n').split('\t')
+            old = resources.get(key, [0, 0])
+            resources[key] = [max(old[0], float(mem)), max(old[1], float(walltime))]
+        except ValueError:
+            continue
+
+    return resources
+
+def write_resources(key, mem, walltime, filename=RESOURCES):
+    """
+    Records the resources requested by a successful job.
+    """
+    f = open(filename, 'ab')
+    f.write('{}\t{:g}\t{:g}\n'.format(key, mem, walltime))
+    f.close()
+
+def get_size(size):
+    """
+    Converts a size reported by qacct (e.g., 1.953G) to bytes.
+    """
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    try:
+        if size and size[-1].upper() in units:
+            return float(size[:-1]) * units[size[-1].upper()]
+        return float(size)
+    except ValueError:
+        return 0.0
+
+def read_acct(name):
+    """
+    Returns the accounting record of the last finished job with this name,
+    from qacct, as a dict. Returns an empty dict if qacct is unavailable or
+    has no record.
+    """
+    try:
+        pipe = subprocess.Popen(['qacct', '-j', name], stdout=subprocess.PIPE,
+                                                       stderr=subprocess.PIPE)
+        out = pipe.communicate()[0]
+    except OSError:
+        return {}
+
+    record = {}
+    for line in out.splitlines():
+        if line.startswith('==='):
+            record = {}
+            continue
+        fields = line.split(None, 1)
+        if len(fields) == 2:
+            record[fields[0]] = fields[1].strip()
+
+    return record
+
+def get_kill_reason(rc, text, acct, mem, walltime):
+    """
+    Returns 'memory' or 'walltime' if a job was killed for exceeding its
+    memory (GB) or walltime (minutes) request, otherwise None. rc is None if
+    the job's log records no exit status (the whole job was killed). The
+    evidence used is, in order: the log, the exit code, and the accounting
+    record (obtained with read_acct()).
+    """
+    if rc == 0:
+        return None
+    if OOM.search(text):
+        return 'memory'
+    if TIMEOUT.search(text) or rc == SIGXCPU:
+        return 'walltime'
+
+    wallclock = get_size(acct.get('ru_wallclock', '0').rstrip('s'))
+    maxvmem = get_size(acct.get('maxvmem', '0'))
+    if walltime and wallclock >= 0.95 * walltime * 60:
+        return 'walltime'
+    if mem and maxvmem >= 0.9 * mem * 2**30:
+        return 'memory'
+
+    # the kernel's OOM killer sends SIGKILL
+    if rc == SIGKILL:
+        return 'memory'
+
+    return None
+
+def escalate(mem, walltime, reason, factor, max_mem, max_walltime):
+    """
+    Returns the [memory, walltime] to request after a job was killed for the
+    given reason, multiplying the exhausted resource by factor up to its cap.
+    Returns None if that resource is already at its cap.
+    """
+    if reason == 'memory':
+        if mem >= max_mem:
+            return None
+        return [min(mem * factor, max_mem), walltime]
+
+    if walltime >= max_walltime:
+        return None
+    return [mem, min(walltime * factor, max_walltime)]
+
+def get_resource_opts(mem, walltime):
+    """
+    Returns the qsub options requesting memory (GB, per slot) and walltime
+    (minutes).
+    """
+    walltime = int(walltime)
+    return '-l h_vmem={:g}G,h_rt={}:{:02d}:00'.format(mem, walltime / 60, walltime % 60)
+
+def get_queued():
+    """
+    Returns the names of this user's jobs known to the scheduler (queued,
+    held or running), from qstat, or None if qstat failed.
+    """
+    pipe = subprocess.Popen('qstat -r', shell=True, stdout=subprocess.PIPE,
+                                                    stderr=subprocess.PIPE)
+    out = pipe.communicate()[0]
+    if pipe.returncode != 0:
+        return None
+
+    names = set()
+    for line in out.splitlines():
+        if line.strip().startswith('Full jobname:'):
+            names.add(line.split(':', 1)[1].strip())
+
+    return names
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Advisory flock-based locks on subjects and runs. Rendered scripts hold a
+shared lock on their subject while they run, and an exclusive lock on their
+run (subject, image modality and ID), so two scripts never write the same
+outputs at once. clean takes an exclusive lock on each subject it removes
+files from, so it never deletes outputs a running script is using.
+
+Locks live in a hidden .locks folder within each subject folder.
+"""
+
+import os
+import fcntl
+
+DIR_LOCKS = '.locks'
+SUBJECT = 'subject.lock'
+
+def get_lock_dir(dir_subj):
+    """
+    Returns the lock folder of a subject, creating it if required.
+    """
+    dir_locks = os.path.join(dir_subj, DIR_LOCKS)
+    if not os.path.isdir(dir_locks):
+        try:
+            os.mkdir(dir_locks)
+        except OSError:
+            if not os.path.isdir(dir_locks):
+                raise
+
+    return dir_locks
+
+def get_rendered_locks():
+    """
+    Returns the BASH that takes, for the rest of a rendered script, the
+    shared subject lock and the exclusive lock on its run, waiting (with a
+    message) for another script running the same subject, modality and ID to
+    finish. The locks are taken on the script's own file descriptors, so they
+    are released when it exits. If flock is not installed, scripts run
+    without locking.
+    """
+    return ('\n# hold a shared lock on the subject while this script runs, and an\n'
+            '# exclusive lock on this run of it (see scriptuit locks)\n'
+            'DIR_LOCKS=${{DIR_DATA}}/${{DIR_EXPT}}/${{SUB}}/{dir_locks}\n'
+            'mkdir -p ${{DIR_LOCKS}}\n'
+            'if command -v flock > /dev/null; then\n'
+            '    exec 8>> ${{DIR_LOCKS}}/{subject}\n'
+            '    flock -s 8\n'
+            '    exec 9>> ${{DIR_LOCKS}}/${{DATA_TYPE}}.${{ID}}.lock\n'
+            '    if ! flock -n -x 9; then\n'
+            '        echo "waiting for another ${{DATA_TYPE}} ${{ID}} script on ${{SUB}}" >&2\n'
+            '        flock -x 9\n'
+            '    fi\n'
+            'fi\n'.format(dir_locks=DIR_LOCKS, subject=SUBJECT))
+
+def lock_subject(dir_subj, wait=True):
+    """
+    Takes an exclusive lock on a subject, blocking until all running scripts
+    using the subject have finished if wait is True. Returns the open lock
+    file (close it to release the lock), or None if the lock is held
+    elsewhere and wait is False.
+    """
+    f = open(os.path.join(get_lock_dir(dir_subj), SUBJECT), 'ab')
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        if not wait:
+            f.close()
+            return None
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    return f
+
+def read_flocks(lines):
+    """
+    Returns a list of [inode, PID] for the flock locks held (not waited for)
+    in lines formatted as /proc/locks.
+    """
+    flocks = []
+    for line in lines:
+        fields = line.split()
+        if fields and fields[0] == 'lock:':
+            fields = fields[1:] # /proc/<pid>/fdinfo/<fd>
+        if '->' in fields:
+            continue # waiting, not holding
+        if len(fields) > 5 and fields[1] == 'FLOCK':
+            flocks.append([int(fields[5].split(':')[-1]), fields[4]])
+
+    return flocks
+
+def get_holders():
+    """
+    Returns a dict of inodes and the PIDs holding flock locks on them. The PID
+    in /proc/locks is that of the process that took the lock, which for
+    rendered scripts is an flock(1) that has since exited, so the holders are
+    found among the processes whose open files hold the lock
+    (/proc/<pid>/fdinfo), leaving out children that inherited it from their
+    parent. Locks whose holders cannot be read are given the PID in
+    /proc/locks. Returns an empty dict if /proc is unavailable.
+    """
+    holders, parents = {}, {}
+    pids = filter(str.isdigit, os.listdir('/proc')) if os.path.isdir('/proc') else []
+    for pid in pids:
+        dir_fdinfo = os.path.join('/proc', pid, 'fdinfo')
+        try:
+            for fd in os.listdir(dir_fdinfo):
+                for inode, _ in read_flocks(open(os.path.join(dir_fdinfo, fd))):
+                    holders.setdefault(inode, set()).add(pid)
+            # the command name in stat may hold spaces, the PPID follows it
+            stat = open(os.path.join('/proc', pid, 'stat')).read()
+            parents[pid] = stat.rsplit(')', 1)[1].split()[1]
+        except (IOError, OSError, IndexError):
+            continue # exited, or not ours to read
+
+    for inode in holders:
+        holders[inode] = sorted([p for p in holders[inode]
+                                     if parents.get(p) not in holders[inode]], key=int)
+
+    try:
+        for inode, pid in read_flocks(open('/proc/locks')):
+            holders.setdefault(inode, [pid])
+    except IOError:
+        pass
+
+    return holders
+
+def inspect(filename):
+    """
+    Returns the state of a lock file: 'free', 'shared' or 'exclusive'.
+    """
+    f = open(filename, 'ab')
+    try:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return 'free'
+        except IOError:
+            pass
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+            return 'shared'
+        except IOError:
+            return 'exclusive'
+    finally:
+        f.close()
+
+def list_locks(directory, subjects, held=True):
+    """
+    Returns [subject, lock, state, PIDs] for the locks of each subject in a
+    directory (of subjects). If held is True, free locks are skipped.
+    """
+    holders = get_holders()
+    locks = []
+
+    for subj in subjects:
+        dir_locks = os.path.join(directory, subj, DIR_LOCKS)
+        if not os.path.isdir(dir_locks):
+            continue
+
+        for name in sorted(os.listdir(dir_locks)):
+            filename = os.path.join(dir_locks, name)
+            state = inspect(filename)
+            if held and state == 'free':
+                continue
+            pids = holders.get(os.stat(filename).st_ino, [])
+            locks.append([subj, os.path.splitext(name)[0], state, pids])
+
+    return locks
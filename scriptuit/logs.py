@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+A compressed, indexed store for job logs written by the queue submission
+tools. Logs are ingested incrementally from a .logs folder, and can then be
+searched for error lines and exit statuses by pipeline u_id, job name and
+subject without reading every log file.
+"""
+
+import os
+import re
+import zlib
+import sqlite3
+
+STORE = '.sit-logs.db'
+MANIFEST = '.manifest'
+
+# job scripts written by scriptuit end their log with this line
+EXIT = re.compile('^scriptuit: exit (-?\d+)$')
+
+# lines worth indexing as errors
+ERRORS = re.compile('error|fail|fatal|killed|exception|traceback|'
+                    'segmentation fault|no such file|not found|cannot|exceeded', re.IGNORECASE)
+
+def get_trailer(var='$?'):
+    """
+    Returns the BASH line that records an exit status at the end of a log.
+    """
+    return 'echo "scriptuit: exit {}"'.format(var)
+
+def get_exit(lines):
+    """
+    Returns the exit status recorded by the last trailer in the lines of a
+    log, or None if there is none (e.g., the scheduler killed the job).
+    """
+    for line in reversed(lines):
+        match = EXIT.match(line.strip())
+        if match:
+            return int(match.group(1))
+
+    return None
+
+def read_exit(log, n_bytes=65536):
+    """
+    Returns the exit status recorded at the end of a log (obtained with
+    get_exit()), and the last n_bytes of the log.
+    """
+    try:
+        f = open(log, 'rb')
+    except IOError:
+        return None, ''
+    f.seek(0, 2)
+    f.seek(max(0, f.tell() - n_bytes))
+    text = f.read()
+    f.close()
+
+    return get_exit(text.splitlines()), text
+
+def write_manifest(dir_logs, log, u_id, job, subject=''):
+    """
+    Records which pipeline (u_id), job and subject a log file belongs to.
+    """
+    f = open(os.path.join(dir_logs, MANIFEST), 'ab')
+    f.write('{}\t{}\t{}\t{}\n'.format(os.path.basename(log), u_id, job, subject))
+    f.close()
+
+def read_manifest(dir_logs):
+    """
+    Returns a dict of log file names and their [u_id, job, subject].
+    """
+    manifest = {}
+    filename = os.path.join(dir_logs, MANIFEST)
+    if not os.path.isfile(filename):
+        return manifest
+
+    for line in open(filename):
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) == 4:
+            manifest[fields[0]] = fields[1:]
+
+    return manifest
+
+def connect(store=STORE):
+    """
+    Opens (creating if required) the log store.
+    """
+    db = sqlite3.connect(store)
+    db.executescript('''
+        CREATE TABLE IF NOT EXISTS logs (
+            id INTEGER PRIMARY KEY,
+            u_id TEXT, job TEXT, subject TEXT,
+            size INTEGER, mtime REAL, status INTEGER,
+            text BLOB,
+            UNIQUE (u_id, job));
+        CREATE TABLE IF NOT EXISTS errors (
+            log INTEGER, line INTEGER, text TEXT);
+        CREATE INDEX IF NOT EXISTS logs_subject ON logs (subject);
+        CREATE INDEX IF NOT EXISTS logs_job ON logs (job);
+        CREATE INDEX IF NOT EXISTS errors_log ON errors (log);''')
+
+    return db
+
+def ingest(dir_logs='.logs', store=STORE):
+    """
+    Adds every log in dir_logs to the store. Logs already in the store with
+    the same size and mtime are skipped. Logs missing from the manifest are
+    stored by file name, with the u_id taken from the name if possible.
+    Returns the number of logs added or updated.
+    """
+    if not os.path.isdir(dir_logs):
+        return 0
+
+    manifest = read_manifest(dir_logs)
+    db = connect(store)
+    n = 0
+
+    for name in sorted(os.listdir(dir_logs)):
+        filename = os.path.join(dir_logs, name)
+        if name.startswith('.') or not os.path.isfile(filename):
+            continue
+
+        if name in manifest:
+            u_id, job, subject = manifest[name]
+        else:
+            u_id = re.search('_([A-Z0-9]{6})(_|$)', name)
+            u_id = u_id.group(1) if u_id else ''
+            job, subject = os.path.splitext(name)[0], ''
+
+        st = os.stat(filename)
+        row = db.execute('SELECT id, size, mtime FROM logs WHERE u_id=? AND job=?',
+                         (u_id, job)).fetchone()
+        if row and row[1] == st.st_size and row[2] == st.st_mtime:
+            continue
+
+        text = open(filename, 'rb').read()
+        lines = text.splitlines()
+        status = get_exit(lines)
+
+        if row:
+            db.execute('DELETE FROM errors WHERE log=?', (row[0],))
+            db.execute('DELETE FROM logs WHERE id=?', (row[0],))
+        cur = db.execute('INSERT INTO logs (u_id, job, subject, size, mtime, status, text) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (u_id, job, subject, st.st_size, st.st_mtime, status,
+                          sqlite3.Binary(zlib.compress(text))))
+        db.executemany('INSERT INTO errors (log, line, text) VALUES (?, ?, ?)',
+                       [(cur.lastrowid, i+1, l.decode('utf-8', 'replace'))
+                        for i, l in enumerate(lines) if ERRORS.search(l)])
+        n += 1
+
+    db.commit()
+    db.close()
+
+    return n
+
+def get_where(u_id=None, job=None, subject=None):
+    """
+    Returns the WHERE clause (and its values) selecting logs by u_id, job (a
+    shell-style wildcard) and subject.
+    """
+    clauses, values = [], []
+    if u_id:
+        clauses.append('logs.u_id=?')
+        values.append(u_id)
+    if subject:
+        clauses.append('logs.subject=?')
+        values.append(subject)
+    if job:
+        clauses.append('logs.job GLOB ?')
+        values.append(job)
+
+    where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+    return where, values
+
+def get_status(u_id=None, job=None, subject=None, store=STORE):
+    """
+    Returns [u_id, job, subject, exit status] of every matching log. The
+    status is None if the log does not record one (e.g., the job was killed).
+    """
+    db = connect(store)
+    where, values = get_where(u_id, job, subject)
+    rows = db.execute('SELECT u_id, job, subject, status FROM logs' + where +
+                      ' ORDER BY u_id, job', values).fetchall()
+    db.close()
+
+    return [list(r) for r in rows]
+
+def get_errors(u_id=None, job=None, subject=None, store=STORE):
+    """
+    Returns [u_id, job, subject, line number, line] of every error line in the
+    matching logs.
+    """
+    db = connect(store)
+    where, values = get_where(u_id, job, subject)
+    rows = db.execute('SELECT logs.u_id, logs.job, logs.subject, errors.line, errors.text '
+                      'FROM errors JOIN logs ON errors.log = logs.id' + where +
+                      ' ORDER BY logs.u_id, logs.job, errors.line', values).fetchall()
+    db.close()
+
+    return [list(r) for r in rows]
+
+def get_text(u_id=None, job=None, subject=None, store=STORE):
+    """
+    Returns [u_id, job, subject, text] of every matching log.
+    """
+    db = connect(store)
+    where, values = get_where(u_id, job, subject)
+    rows = db.execute('SELECT u_id, job, subject, text FROM logs' + where +
+                      ' ORDER BY u_id, job', values).fetchall()
+    db.close()
+
+    return [[r[0], r[1], r[2], zlib.decompress(r[3])] for r in rows]
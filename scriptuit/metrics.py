@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+"""
+Opt-in runtime metrics in the Prometheus text format. If SCRIPTUIT_METRICS
+names a folder, rendered scripts (stage durations and failures), render,
+sit-queue, sit-sharc and clean append one line per event to the events file in
+that folder. Nothing is recorded if it is unset.
+
+The events are aggregated incrementally (the totals, and the offset of the
+last event read, are kept in the same folder), and written as a textfile for
+the node_exporter textfile collector, or served over HTTP (scriptuit metrics).
+"""
+
+import os
+import re
+import json
+import time
+import fcntl
+
+EVENTS = 'events'
+STATE = 'state.json'
+
+# histogram buckets, in seconds
+STAGE_BUCKETS = [1, 10, 60, 300, 900, 1800, 3600, 7200, 14400, 43200, 86400]
+SUBMIT_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+# metric name: [type, help, buckets]
+METRICS = {
+    'scriptuit_renders_total':
+        ['counter', 'Master scripts rendered.', None],
+    'scriptuit_subjects_total':
+        ['counter', 'Subjects run through a rendered script, by exit status.', None],
+    'scriptuit_stage_duration_seconds':
+        ['histogram', 'Duration of successful stages, by module.', STAGE_BUCKETS],
+    'scriptuit_stage_failures_total':
+        ['counter', 'Stages that exited with an error, by module.', None],
+    'scriptuit_jobs_submitted_total':
+        ['counter', 'Jobs submitted, by backend and queue.', None],
+    'scriptuit_submission_failures_total':
+        ['counter', 'Job submissions rejected by the scheduler.', None],
+    'scriptuit_submission_latency_seconds':
+        ['histogram', 'Time taken to submit a job.', SUBMIT_BUCKETS],
+    'scriptuit_cleaned_bytes_total':
+        ['counter', 'Bytes removed by scriptuit clean.', None]}
+
+# event: the metrics it updates, and the amount (None for the event's value)
+UPDATES = {
+    'render': [['scriptuit_renders_total', None]],
+    'subject': [['scriptuit_subjects_total', None]],
+    'stage': [['scriptuit_stage_duration_seconds', None]],
+    'stage_failed': [['scriptuit_stage_failures_total', None]],
+    'submit': [['scriptuit_jobs_submitted_total', 1],
+               ['scriptuit_submission_latency_seconds', None]],
+    'submit_failed': [['scriptuit_submission_failures_total', None]],
+    'clean': [['scriptuit_cleaned_bytes_total', None]]}
+
+def get_dir():
+    """
+    Returns the metrics folder, or None if metrics are not enabled.
+    """
+    return os.getenv('SCRIPTUIT_METRICS') or None
+
+def get_rendered_metrics():
+    """
+    Returns the BASH that records the duration of each stage of a rendered
+    script, the stage it failed in (if any), and its exit status, whenever
+    SCRIPTUIT_METRICS is set where the script runs.
+
+    The exit status is recorded by sit_exit, installed once as the EXIT trap.
+    Modules that need to clean up on exit pass the command to sit_on_exit,
+    which sit_exit runs first; a module that sets its own EXIT trap replaces
+    sit_exit, and its subject's exit status is not recorded.
+    """
+    return ('\n# record stage durations and failures if SCRIPTUIT_METRICS is set\n'
+            '# (see scriptuit metrics)\n'
+            'sit_event() {\n'
+            '    printf "%s\\t%s\\t%s\\t%s\\n" $(date +%s) ${1} "${2}" ${3} \\\n'
+            '        2> /dev/null >> ${SCRIPTUIT_METRICS}/events || true\n'
+            '}\n\n'
+            'sit_begin() {\n'
+            '    SIT_STAGE=${1}\n'
+            '    if [ -n "${SCRIPTUIT_METRICS}" ]; then\n'
+            '        SIT_START=$(date +%s.%N)\n'
+            '    fi\n'
+            '}\n\n'
+            'sit_end() {\n'
+            '    if [ -n "${SCRIPTUIT_METRICS}" ]; then\n'
+            '        sit_event stage "module=${SIT_STAGE},id=${ID}" \\\n'
+            '            $(awk "BEGIN {print $(date +%s.%N) - ${SIT_START}}")\n'
+            '    fi\n'
+            '    SIT_STAGE=\n'
+            '}\n\n'
+            '# modules add commands to run on exit with sit_on_exit, rather than trap\n'
+            'sit_on_exit() {\n'
+            '    SIT_ON_EXIT="${SIT_ON_EXIT:-}${1}\n'
+            '"\n'
+            '}\n\n'
+            'sit_exit() {\n'
+            '    local rc=$?\n'
+            '    eval "${SIT_ON_EXIT:-}" || true\n'
+            '    if [ -n "${SCRIPTUIT_METRICS}" ]; then\n'
+            '        if [ ${rc} -ne 0 ] && [ -n "${SIT_STAGE}" ]; then\n'
+            '            sit_event stage_failed "module=${SIT_STAGE},id=${ID}" 1\n'
+            '        fi\n'
+            '        sit_event subject "id=${ID},status=$([ ${rc} -eq 0 ] && echo ok || echo failed)" 1\n'
+            '    fi\n'
+            '}\n'
+            'trap sit_exit EXIT\n')
+
+def record(event, labels={}, value=1):
+    """
+    Appends an event to the events file, if metrics are enabled. Each event
+    is a single short write, so concurrent writers do not interleave. Errors
+    are ignored: metrics never stop a pipeline.
+    """
+    directory = get_dir()
+    if not directory:
+        return
+
+    line = '{}\t{}\t{}\t{}\n'.format(int(time.time()), event,
+               ','.join('{}={}'.format(k, labels[k]) for k in sorted(labels)), value)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd = os.open(os.path.join(directory, EVENTS), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        os.write(fd, line)
+        os.close(fd)
+    except OSError:
+        pass
+
+def get_queue(cmd):
+    """
+    Returns the queue a qsub or sqsub command submits to ('' if none).
+    """
+    match = re.search(r'\s-q\s+(\S+)', cmd)
+    return match.group(1) if match else ''
+
+def update(state, event, labels, value):
+    """
+    Adds an event to the aggregated metrics.
+    """
+    for name, amount in UPDATES.get(event, []):
+        kind, description, buckets = METRICS[name]
+        x = value if amount is None else amount
+        series = state['metrics'].setdefault(name, {})
+        if kind == 'counter':
+            series[labels] = series.get(labels, 0) + x
+        else:
+            h = series.setdefault(labels, [0] * (len(buckets) + 2))
+            for i, b in enumerate(buckets):
+                if x <= b:
+                    h[i] += 1
+            h[-2] += x
+            h[-1] += 1
+
+def aggregate(directory):
+    """
+    Adds the events appended since the last aggregation to the totals stored
+    in the metrics folder, and returns the totals. If the events file was
+    truncated (e.g., rotated), it is read from the start.
+    """
+    events = os.path.join(directory, EVENTS)
+    lock = open(os.path.join(directory, STATE + '.lock'), 'ab')
+    fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+
+    try:
+        try:
+            state = json.load(open(os.path.join(directory, STATE)))
+        except (IOError, ValueError):
+            state = {'offset': 0, 'metrics': {}}
+
+        if os.path.isfile(events):
+            if os.path.getsize(events) < state['offset']:
+                state['offset'] = 0
+
+            f = open(events, 'rb')
+            f.seek(state['offset'])
+            data = f.read()
+            f.close()
+
+            # a partially written last line is read next time
+            data = data[:data.rfind('\n') + 1]
+            for line in data.splitlines():
+                try:
+                    stamp, event, labels, value = line.split('\t')
+                    update(state, event, labels, float(value))
+                except ValueError:
+                    continue
+            state['offset'] += len(data)
+
+        tmp = os.path.join(directory, '{}.tmp{}'.format(STATE, os.getpid()))
+        f = open(tmp, 'wb')
+        json.dump(state, f)
+        f.close()
+        os.rename(tmp, os.path.join(directory, STATE))
+    finally:
+        lock.close()
+
+    return state['metrics']
+
+def get_labels(labels, extra=''):
+    """
+    Returns event labels (k=v,k=v) in the Prometheus format.
+    """
+    pairs = [l.split('=', 1) for l in labels.split(',') if '=' in l]
+    if extra:
+        pairs.append(extra.split('=', 1))
+    if not pairs:
+        return ''
+    escape = lambda v: v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join('{}="{}"'.format(k, escape(v)) for k, v in pairs) + '}'
+
+def get_text(metrics):
+    """
+    Returns the aggregated metrics in the Prometheus text format.
+    """
+    lines = []
+    for name in sorted(METRICS):
+        kind, description, buckets = METRICS[name]
+        lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} {}'.format(name, kind))
+
+        for labels, value in sorted(metrics.get(name, {}).items()):
+            if kind == 'counter':
+                lines.append('{}{} {:g}'.format(name, get_labels(labels), value))
+                continue
+
+            for b, n in zip(buckets, value):
+                lines.append('{}_bucket{} {}'.format(name, get_labels(labels, 'le={:g}'.format(b)), n))
+            lines.append('{}_bucket{} {}'.format(name, get_labels(labels, 'le=+Inf'), value[-1]))
+            lines.append('{}_sum{} {:g}'.format(name, get_labels(labels), value[-2]))
+            lines.append('{}_count{} {}'.format(name, get_labels(labels), value[-1]))
+
+    return '\n'.join(lines) + '\n'
+
+def write_textfile(filename, text):
+    """
+    Writes the metrics for the textfile collector, replacing the old file in
+    one step so it is never read half written.
+    """
+    tmp = '{}.tmp{}'.format(filename, os.getpid())
+    f = open(tmp, 'wb')
+    f.write(text)
+    f.close()
+    os.rename(tmp, filename)
+
+def serve(directory, port, address='127.0.0.1'):
+    """
+    Serves the metrics on http://address:port/metrics (only to this host by
+    default), aggregating new events on each request.
+    """
+    import BaseHTTPServer
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ['/', '/metrics']:
+                self.send_error(404)
+                return
+            text = get_text(aggregate(directory))
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(text)))
+            self.end_headers()
+            self.wfile.write(text)
+
+        def log_message(self, *args):
+            pass
+
+    BaseHTTPServer.HTTPServer((address, port), Handler).serve_forever()
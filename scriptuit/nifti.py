@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Header-level validation of NIFTI-1 files. Only the 348 byte header is read
+(and, for .nii.gz files, the gzip trailer), so large experiments can be
+checked quickly. A .nii.gz file is only decompressed in full when its trailer
+does not account for the data (it holds the size of the last gzip member
+only, modulo 2^32). Results are cached by path, size and mtime.
+"""
+
+import os
+import json
+import mmap
+import struct
+import zlib
+
+HEADER_SIZE = 348
+
+# bits per voxel of each NIFTI-1 datatype code
+DATATYPES = {2: 8, 4: 16, 8: 32, 16: 32, 32: 64, 64: 64, 128: 24, 256: 8,
+             512: 16, 768: 32, 1024: 64, 1280: 64, 1536: 128, 1792: 128,
+             2048: 256, 2304: 32}
+
+def read_header(filename):
+    """
+    Returns the first 348 bytes of a .nii (via mmap) or .nii.gz (decompressing
+    only as much of the stream as needed) file. Raises IOError if the file is
+    too short to contain a header.
+    """
+    f = open(filename, 'rb')
+    try:
+        if filename.endswith('.gz'):
+            d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            header = ''
+            while len(header) < HEADER_SIZE:
+                block = d.unconsumed_tail or f.read(4096)
+                if not block:
+                    break
+                header += d.decompress(block, HEADER_SIZE - len(header))
+        else:
+            if os.fstat(f.fileno()).st_size < HEADER_SIZE:
+                raise IOError('truncated header')
+            m = mmap.mmap(f.fileno(), HEADER_SIZE, access=mmap.ACCESS_READ)
+            header = m[:HEADER_SIZE]
+            m.close()
+    except zlib.error:
+        raise IOError('corrupt gzip stream')
+    finally:
+        f.close()
+
+    if len(header) < HEADER_SIZE:
+        raise IOError('truncated header')
+
+    return header
+
+def get_data_size(filename):
+    """
+    Returns the size of the (uncompressed) file. For .nii.gz files, this is
+    read from the gzip trailer, and is only known modulo 2^32.
+    """
+    if not filename.endswith('.gz'):
+        return os.path.getsize(filename)
+
+    f = open(filename, 'rb')
+    try:
+        f.seek(-4, os.SEEK_END)
+        return struct.unpack('<I', f.read(4))[0]
+    finally:
+        f.close()
+
+def get_stream_size(filename):
+    """
+    Returns the uncompressed size of a .nii.gz file, decompressing every gzip
+    member in it. Raises IOError if the stream is corrupt.
+    """
+    f = open(filename, 'rb')
+    try:
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        size, pending = 0, ''
+        while True:
+            block = d.unconsumed_tail or pending or f.read(1 << 20)
+            if not block:
+                break
+            size += len(d.decompress(block, 1 << 20))
+            # another member follows (or zero padding, as gzip allows)
+            pending = d.unused_data.lstrip('\0')
+            if pending:
+                d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    except zlib.error:
+        raise IOError('corrupt gzip stream')
+    finally:
+        f.close()
+
+    return size
+
+def validate(filename):
+    """
+    Checks the header of a NIFTI-1 file: header size, magic string, dims,
+    datatype, and that the file is large enough to hold the data described.
+    Returns None if the file is valid, and a description of the problem
+    otherwise.
+    """
+    try:
+        header = read_header(filename)
+    except IOError as err:
+        return str(err)
+
+    # the header size gives away the byte order
+    for endian in '<>':
+        if struct.unpack(endian + 'i', header[0:4])[0] == HEADER_SIZE:
+            break
+    else:
+        return 'not a NIFTI-1 header'
+
+    magic = header[344:348]
+    if magic != 'n+1\0':
+        return 'bad magic {}'.format(repr(magic))
+
+    dims = struct.unpack(endian + '8h', header[40:56])
+    if not 1 <= dims[0] <= 7:
+        return 'bad number of dims {}'.format(dims[0])
+    if any(d < 1 for d in dims[1:dims[0]+1]):
+        return 'bad dims {}'.format(dims[1:dims[0]+1])
+
+    datatype, bitpix = struct.unpack(endian + '2h', header[70:74])
+    if datatype not in DATATYPES:
+        return 'unknown datatype {}'.format(datatype)
+    if DATATYPES[datatype] != bitpix:
+        return 'bitpix {} does not match datatype {}'.format(bitpix, datatype)
+
+    vox_offset = struct.unpack(endian + 'f', header[108:112])[0]
+    n_voxels = 1
+    for d in dims[1:dims[0]+1]:
+        n_voxels *= d
+    expected = int(vox_offset) + n_voxels * bitpix / 8
+
+    try:
+        size = get_data_size(filename)
+    except IOError as err:
+        return str(err)
+
+    # the trailer is only enough to tell a single member under 4G is complete
+    if filename.endswith('.gz') and (size < expected or expected >= 2**32):
+        try:
+            size = get_stream_size(filename)
+        except IOError as err:
+            return str(err)
+
+    if size < expected:
+        return 'truncated: {} bytes, expected {}'.format(size, expected)
+
+    return None
+
+def read_cache(filename):
+    """
+    Returns the validation cache stored in filename, or an empty cache.
+    """
+    try:
+        return json.load(open(filename))
+    except (IOError, ValueError):
+        return {}
+
+def write_cache(filename, cache):
+    """
+    Writes the validation cache to filename, replacing it in one step.
+    """
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+
+    tmp = '{}.tmp{}'.format(filename, os.getpid())
+    f = open(tmp, 'wb')
+    json.dump(cache, f)
+    f.close()
+    os.rename(tmp, filename)
+
+def check_files(files, cache_file=None, n_threads=8):
+    """
+    Validates each file, n_threads at a time, and returns a dict of filenames
+    and problems (None for valid files). If cache_file is defined, files whose
+    path, size and mtime are unchanged since the last check are not read.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    cache = read_cache(cache_file) if cache_file else {}
+
+    def check(filename):
+        st = os.stat(filename)
+        entry = cache.get(filename)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime:
+            return filename, entry
+        return filename, [st.st_size, st.st_mtime, validate(filename)]
+
+    pool = ThreadPool(max(1, n_threads))
+    try:
+        results = dict(pool.map(check, files))
+    finally:
+        pool.close()
+
+    if cache_file:
+        cache.update(results)
+        write_cache(cache_file, cache)
+
+    return dict((f, r[2]) for f, r in results.items())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Longest-first ordering of subjects. When subjects are dispatched in name order
+the largest often start last, and the whole cohort waits on them. Each
+subject's duration is estimated from its own history if it has one, otherwise
+from the size of its inputs (NIFTI bytes in its RUN folders), and subjects are
+dispatched most expensive first.
+
+Makespans (the time from the first start to the last finish, with n subjects
+running at once) are simulated by replaying an order through n slots, each
+subject starting on the first slot to become free, so reports are
+reproducible. The achieved makespan of a past run is measured separately,
+from the start and end times recorded in the history.
+"""
+
+import heapq
+
+from scriptuit import utilities
+
+def get_median(x):
+    """
+    Returns the median of a non-empty list.
+    """
+    s = sorted(x)
+    n = len(s)
+    return s[n/2] if n % 2 == 1 else (s[n/2-1] + s[n/2]) / 2.0
+
+def get_inventories(directory, subjects, mode, sess=None, n_threads=8):
+    """
+    Returns the inventory of each subject (obtained with get_inventory()),
+    n_threads subjects at a time.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(max(1, n_threads))
+    try:
+        return pool.map(lambda s: utilities.get_inventory(directory, s, mode, [], sess),
+                        subjects)
+    finally:
+        pool.close()
+
+def get_estimates(inventories, history={}, default=600.0, own=True):
+    """
+    Returns a dict of subjects and their estimated durations in seconds. A
+    subject with history (a dict of subjects and recorded durations) is given
+    its median duration, unless own is False. Otherwise its duration is
+    proportional to its input bytes: the rate is that of the subjects with
+    history, or, without any, such that the average subject takes the
+    default. Subjects without NIFTI inputs have no size, and take the
+    default.
+    """
+    known = [inv for inv in inventories if history.get(inv['subject']) and inv['bytes']]
+    known_size = sum(inv['bytes'] for inv in known)
+    if known_size:
+        rate = sum(get_median(history[inv['subject']]) for inv in known) / float(known_size)
+    else:
+        sizes = [inv['bytes'] for inv in inventories if inv['bytes']]
+        rate = default / (sum(sizes) / float(len(sizes))) if sizes else 0
+
+    estimates = {}
+    for inv in inventories:
+        if own and history.get(inv['subject']):
+            estimates[inv['subject']] = get_median(history[inv['subject']])
+        elif inv['bytes'] and rate:
+            estimates[inv['subject']] = inv['bytes'] * rate
+        else:
+            estimates[inv['subject']] = default
+
+    return estimates
+
+def get_order(estimates):
+    """
+    Returns the subjects, most expensive first (ties in name order).
+    """
+    return sorted(estimates, key=lambda s: (-estimates[s], s))
+
+def get_makespan(order, durations, n_slots):
+    """
+    Returns the makespan of running subjects in order through n_slots slots,
+    each subject starting on the first slot to become free.
+    """
+    slots = [0.0] * max(1, n_slots)
+    for subj in order:
+        heapq.heappush(slots, heapq.heappop(slots) + durations[subj])
+
+    return max(slots)
+
+def get_report(inventories, history, n_slots, default=600.0):
+    """
+    Returns rows of [order, predicted makespan, replayed makespan] for name
+    order and longest-first order. Predictions use input sizes only (scaled
+    by the history of all subjects), as they would be before a run. The
+    replayed makespan simulates each order with the median recorded duration
+    of each subject, and is None unless every subject has history.
+    """
+    estimates = get_estimates(inventories, history, default, own=False)
+
+    recorded = None
+    if all(history.get(s) for s in estimates):
+        recorded = dict((s, get_median(history[s])) for s in estimates)
+
+    rows = []
+    for name, order in [['name', sorted(estimates)],
+                        ['longest-first', get_order(estimates)]]:
+        rows.append([name, get_makespan(order, estimates, n_slots),
+                     get_makespan(order, recorded, n_slots) if recorded else None])
+
+    return rows
+
+def get_achieved(times, subjects):
+    """
+    Returns the achieved makespan of the subjects in seconds: the first start
+    to the last finish of their last recorded runs (obtained with
+    read_subject_times()), or None unless every subject has one.
+    """
+    if not subjects or not all(s in times for s in subjects):
+        return None
+
+    return (max(times[s][1] for s in subjects) -
+            min(times[s][0] for s in subjects))
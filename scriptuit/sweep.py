@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""
+Parameter sweeps over a master script. Option grids for specific module
+invocations are expanded into variants, and the variants are organized as a
+prefix tree of segments (runs of stages shared by a group of variants), so
+each distinct stage configuration is run once per subject.
+
+Each segment writes its outputs under its own ID. A segment starts by linking
+the outputs of its parent segment to its own ID (following the scriptuit
+naming convention, <prefix>.<ID>.<run>.<extension>), so its stages start from
+the shared upstream outputs. The root segment uses the master script's ID.
+"""
+
+import os
+import hashlib
+import itertools
+
+from scriptuit import utilities
+
+INHERIT = '''
+# link the outputs of the parent segment ${1} to this segment's ID
+sit_inherit() {
+    local dir_mode=${DIR_DATA}/${DIR_EXPT}/${SUB}/${DATA_TYPE}
+    for f in $(find ${dir_mode} -maxdepth 2 -type f -name "*.${1}.*"); do
+        local g=$(dirname ${f})/$(basename ${f} | sed "s/\\.${1}\\./.${ID}./")
+        if [ ! -e ${g} ]; then
+            ln ${f} ${g} 2> /dev/null || cp -p ${f} ${g}
+        fi
+    done
+}
+
+'''
+
+def parse_grid(specs, invocations, dir_modules):
+    """
+    Parses option grids of the form module.arg=v1,v2,..., where arg is the
+    name of the argument in the module header (or its position, from 1). If a
+    module is invoked more than once, module:n selects the nth invocation.
+    Returns a list of [invocation index, word index, label, values].
+    """
+    grid = []
+    for spec in specs:
+        try:
+            target, values = spec.split('=', 1)
+            module, arg = target.rsplit('.', 1)
+            module, n = (module.split(':') + ['1'])[:2]
+            n = int(n)
+        except ValueError:
+            raise ValueError('ERROR: malformed grid {}, expected module.arg=v1,v2'.format(spec))
+
+        found = [i for i, words in enumerate(invocations) if words[0] == module]
+        if len(found) < n:
+            raise ValueError('ERROR: module {} is not invoked {} time(s) in the master script'.format(module, n))
+        i = found[n-1]
+
+        if arg.isdigit():
+            pos = int(arg)
+        else:
+            header = utilities.get_header(os.path.join(dir_modules, module))
+            args = utilities.get_line(header, module) or []
+            if arg not in args:
+                raise ValueError('ERROR: module {} has no argument {}'.format(module, arg))
+            pos = args.index(arg) + 1
+
+        if not 0 < pos < len(invocations[i]):
+            raise ValueError('ERROR: module {} has no argument {}'.format(module, arg))
+
+        grid.append([i, pos, target, filter(lambda x: x != '', values.split(','))])
+
+    return grid
+
+def expand(invocations, grid):
+    """
+    Returns the variants of the master script, one per combination of grid
+    values, as a list of [assignments, invocations]. Duplicate variants are
+    removed.
+    """
+    variants = []
+    seen = set()
+
+    for combo in itertools.product(*[g[3] for g in grid]):
+        invs = [list(words) for words in invocations]
+        assignments = []
+        for (i, pos, label, values), value in zip(grid, combo):
+            invs[i][pos] = value
+            assignments.append('{}={}'.format(label, value))
+
+        lines = tuple(' '.join(words) for words in invs)
+        if lines not in seen:
+            seen.add(lines)
+            variants.append([assignments, invs])
+
+    return variants
+
+def get_segments(variants, ID):
+    """
+    Organizes variants as a prefix tree. Returns the segments in the order
+    they should run (parents first), each a dict with its ID, its parent's ID
+    (None for the root), its stages (invocations), and the assignments of the
+    variants that end with it.
+    """
+    segments = []
+    n_stages = len(variants[0][1])
+
+    def grow(group, depth, parent, path):
+        line = ' '.join(group[0][1][depth]) if depth < n_stages else ''
+        if parent is None:
+            seg_id = ID
+        else:
+            seg_id = '{}-{}'.format(ID, hashlib.sha1('\n'.join(path + [line])).hexdigest()[:8])
+
+        segment = {'id': seg_id, 'parent': parent, 'stages': [], 'variants': []}
+        segments.append(segment)
+
+        while depth < n_stages:
+            lines = []
+            for assignments, invs in group:
+                if ' '.join(invs[depth]) not in lines:
+                    lines.append(' '.join(invs[depth]))
+
+            # branch: each distinct configuration of this stage is a child
+            if len(lines) > 1:
+                for line in lines:
+                    sub = [v for v in group if ' '.join(v[1][depth]) == line]
+                    grow(sub, depth, seg_id, list(path))
+                return
+
+            segment['stages'].append(group[0][1][depth])
+            path.append(lines[0])
+            depth += 1
+
+        segment['variants'] = [assignments for assignments, invs in group]
+
+    grow(variants, 0, None, [])
+
+    return segments
+
+def write_sweep(script, variables, segments, dir_modules, output):
+    """
+    Writes one script per segment, a driver script that runs every segment
+    for a subject (sweep_<ID>.sh), and a table of the variants (variants.tsv)
+    into the output directory. Returns the path of the driver script.
+    """
+    if not os.path.isdir(output):
+        os.makedirs(output)
+
+    for segment in segments:
+        seg_vars = dict(variables)
+        seg_vars['ID'] = segment['id']
+
+        f = open(os.path.join(output, '{}.sh'.format(segment['id'])), 'wb')
+        f.write(utilities.get_rendered_header(script, seg_vars))
+        if segment['parent']:
+            f.write(INHERIT)
+            f.write('sit_inherit {}\n\n'.format(segment['parent']))
+        f.writelines(utilities.get_rendered_stages(segment['stages'], dir_modules))
+        f.close()
+        os.chmod(os.path.join(output, '{}.sh'.format(segment['id'])), 0755)
+
+    driver = os.path.join(output, 'sweep_{}.sh'.format(variables['ID']))
+    f = open(driver, 'wb')
+    f.write('#!/bin/bash\n\n'
+            '# scriptuit sweep of {script}: {n_var} variants in {n_seg} segments.\n\n'
+            'set -e\n\n'
+            'if [ -z ${{1}} ]; then\n'
+            '    echo "Usage:"\n'
+            '    echo "    $(basename ${{0}}) subject"\n'
+            '    exit 1\n'
+            'fi\n\n'
+            'DIR=$(cd $(dirname ${{0}}) && pwd)\n'.format(
+                script=script,
+                n_var=sum(len(s['variants']) for s in segments),
+                n_seg=len(segments)))
+    for segment in segments:
+        f.write('${{DIR}}/{}.sh ${{1}}\n'.format(segment['id']))
+    f.close()
+    os.chmod(driver, 0755)
+
+    f = open(os.path.join(output, 'variants.tsv'), 'wb')
+    for segment in segments:
+        for assignments in segment['variants']:
+            f.write('{}\t{}\n'.format(segment['id'], '\t'.join(assignments)))
+    f.close()
+
+    return driver
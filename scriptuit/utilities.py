@@ -147,13 +147,17 @@ def touch(f):
 
 def purge(files, replace=False):
     """
-    Takes a list of filenames and attempts to remove them.
+    Takes a list of filenames and attempts to remove them. Returns the number
+    of bytes freed.
     """
+    freed = 0
     if len(files) > 0:
         for f in files:
+            freed += os.path.getsize(f)
             os.remove(f)
             if replace:
                 touch(f)
+    return freed
 
 def find_files(directory, include, exclude=None, level=1):
     """
@@ -227,6 +231,238 @@ def get_subj(directory):
 
     return subjects
 
+def is_folder_name(name):
+    """
+    Returns True if name can be used as a single subject or modality folder:
+    it is not empty, hidden, or a path.
+    """
+    return (name != '' and not name.startswith('.') and
+            os.path.sep not in name and '/' not in name)
+
+def read_folder_spec(filename):
+    """
+    Reads a folder specification from a CSV file (with a header) or a JSON
+    file (a list of objects). Each entry has a subject, mode, number of
+    sessions, and runs per session, either one number for all sessions or one
+    per session (a list in JSON, separated by ';' in CSV), e.g.,
+
+        subject,mode,sessions,runs
+        S001,FUNC,2,3;1
+
+    Returns a list of dicts with the keys subject, mode and runs (a list with
+    the number of runs in each session). Raises a ValueError for malformed
+    entries, including subjects and modes that are not plain ASCII folder
+    names (e.g., empty, or containing '/' or '..').
+    """
+    import csv
+    import json
+
+    if filename.endswith('.json'):
+        entries = json.load(open(filename))
+    else:
+        entries = list(csv.DictReader(open(filename, 'rb')))
+
+    spec = []
+    for i, entry in enumerate(entries):
+        try:
+            n_sess = int(entry['sessions'])
+            runs = entry['runs']
+            if isinstance(runs, basestring):
+                runs = runs.split(';')
+            elif not isinstance(runs, list):
+                runs = [runs]
+            runs = [int(r) for r in runs]
+            if len(runs) == 1:
+                runs = runs * n_sess
+            assert len(runs) == n_sess
+            subject = mangle_string(str(entry['subject']).strip())
+            mode = str(entry['mode']).strip()
+        except (KeyError, ValueError, AssertionError):
+            raise ValueError('ERROR: malformed entry {} in {}'.format(i+1, filename))
+        except UnicodeError:
+            raise ValueError('ERROR: entry {} in {} is not ASCII'.format(i+1, filename))
+
+        for name in [subject, mode]:
+            if not is_folder_name(name):
+                raise ValueError('ERROR: entry {} in {} has an invalid folder name {!r}'.format(
+                                 i+1, filename, name))
+        spec.append({'subject': subject, 'mode': mode, 'runs': runs})
+
+    return spec
+
+def get_folders(spec):
+    """
+    Returns a dict of subject names and the folders (relative to the
+    experiment) defined for each in spec (obtained with read_folder_spec()).
+    """
+    folders = {}
+    for entry in spec:
+        subj, mode = entry['subject'], entry['mode']
+        dirs = folders.setdefault(subj, [subj])
+        dirs.append(os.path.join(subj, mode))
+        for s, n_runs in enumerate(entry['runs']):
+            sess = os.path.join(subj, mode, 'SESS%02d' % (s+1))
+            dirs.append(sess)
+            dirs.extend(os.path.join(sess, 'RUN%02d' % (r+1)) for r in range(n_runs))
+
+    return folders
+
+def get_template_folders(template, subjects):
+    """
+    Returns a dict of subject names and the folders (relative to the
+    experiment) required to copy the folder structure of the template subject
+    (files are not copied). Hidden folders are skipped.
+    """
+    rel = []
+    for pth, dirs, files in os.walk(template, topdown=True):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        rel.extend(os.path.relpath(os.path.join(pth, d), template) for d in dirs)
+
+    return dict((s, [s] + [os.path.join(s, d) for d in rel]) for s in subjects)
+
+def make_folders(directory, folders, n_threads=8):
+    """
+    Creates the folders (obtained with get_folders() or get_template_folders())
+    within directory, n_threads subjects at a time. Existing folders are left
+    alone. Returns the folders that were created, sorted.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    def make_subject(dirs):
+        created = []
+        for d in dirs:
+            d = os.path.join(directory, d)
+            if not os.path.isdir(d):
+                os.makedirs(d)
+                created.append(d)
+        return created
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    pool = ThreadPool(max(1, n_threads))
+    try:
+        created = pool.map(make_subject, folders.values())
+    finally:
+        pool.close()
+
+    return sorted(d for dirs in created for d in dirs)
+
+def get_inventory(directory, subj, mode, prefixes=[], sess=None):
+    """
+    Walks a single subject's image modality folder once. Returns a dict with
+    the newest input file mtime (files within RUN folders), the number of RUN
+    folders and the bytes of NIFTI inputs within them, and, for each prefix,
+    the number of stage outputs named <prefix>.* and the oldest of their
+    mtimes (so func does not match func_b.*). If sess is defined, only that
+    session is inspected.
+    """
+    inventory = {'subject': subj, 'exists': False, 'inputs': None,
+                 'runs': 0, 'bytes': 0,
+                 'outputs': dict((p, [0, None]) for p in prefixes)}
+
+    dir_mode = os.path.join(directory, subj, mode)
+    if not os.path.isdir(dir_mode):
+        return inventory
+    inventory['exists'] = True
+
+    for pth, dirs, files in os.walk(dir_mode, topdown=True):
+        rel = os.path.relpath(pth, dir_mode).split(os.path.sep)
+
+        # restrict to the selected session
+        if sess and rel[0] != '.' and rel[0] != sess:
+            del dirs[:]
+            continue
+
+        # inputs live in the RUN folders, stage outputs live above them
+        if len(rel) > 1 and rel[1].startswith('RUN'):
+            if len(rel) == 2:
+                inventory['runs'] += 1
+            for f in files:
+                st = os.stat(os.path.join(pth, f))
+                if inventory['inputs'] is None or st.st_mtime > inventory['inputs']:
+                    inventory['inputs'] = st.st_mtime
+                if f.endswith('.nii') or f.endswith('.nii.gz'):
+                    inventory['bytes'] += st.st_size
+            continue
+
+        for f in files:
+            for p in prefixes:
+                if f.startswith(p + '.'):
+                    mtime = os.path.getmtime(os.path.join(pth, f))
+                    output = inventory['outputs'][p]
+                    output[0] += 1
+                    if output[1] is None or mtime < output[1]:
+                        output[1] = mtime
+
+    return inventory
+
+def is_stale(inventory, prefix):
+    """
+    Returns True if the outputs with the given prefix are missing from the
+    inventory, or are older than the newest input file.
+    """
+    n_files, mtime = inventory['outputs'][prefix]
+    if n_files == 0:
+        return True
+    if inventory['inputs'] is not None and inventory['inputs'] > mtime:
+        return True
+    return False
+
+def query_subj(directory, pattern=None, regex=None, mode=None, sess=None,
+               has=[], missing=[], stale=[], n_threads=8):
+    """
+    Returns the subjects in a directory (of subjects) that match all of the
+    supplied criteria:
+
+        pattern -- shell-style wildcard matched against the subject name.
+        regex   -- regular expression searched for in the subject name.
+        has     -- prefixes with at least one stage output in mode/sess.
+        missing -- prefixes without any stage output in mode/sess.
+        stale   -- prefixes with outputs missing, or older than the newest input.
+                   Unlike has and missing, one stale prefix is enough: the
+                   subject then needs that stage rerun.
+
+    Output criteria require mode, and are evaluated with a single walk of each
+    subject folder, n_threads subjects at a time. Order is that of get_subj.
+    """
+    from fnmatch import fnmatch
+    from multiprocessing.pool import ThreadPool
+
+    subjects = get_subj(directory)
+    if pattern:
+        subjects = filter(lambda x: fnmatch(x, pattern), subjects)
+    if regex:
+        r = re.compile(regex)
+        subjects = filter(lambda x: r.search(x), subjects)
+
+    prefixes = list(set(has + missing + stale))
+    if not prefixes:
+        return subjects
+    if not mode:
+        raise ValueError('ERROR: an image modality is required to query stage outputs')
+
+    pool = ThreadPool(max(1, n_threads))
+    try:
+        inventories = pool.map(
+            lambda s: get_inventory(directory, s, mode, prefixes, sess), subjects)
+    finally:
+        pool.close()
+
+    selected = []
+    for inv in inventories:
+        if not inv['exists']:
+            continue
+        if any(inv['outputs'][p][0] == 0 for p in has):
+            continue
+        if any(inv['outputs'][p][0] > 0 for p in missing):
+            continue
+        if stale and not any(is_stale(inv, p) for p in stale):
+            continue
+        selected.append(inv['subject'])
+
+    return selected
+
 def get_header(filename):
     """
     Returns each line of the module header as a list.
@@ -281,6 +517,246 @@ def get_body(filename):
 
     return body
 
+def parse_master(lines, modules):
+    """
+    Parses the lines of a master script in a single pass. Returns a dict of
+    the variables defined (NAME=value), and an ordered list of the module
+    invocations, each a list of the module name followed by its arguments.
+
+    A line is an invocation if its first word is in modules (a set of module
+    names), so the same module can be invoked any number of times.
+    """
+    variables = {}
+    invocations = []
+
+    for line in lines:
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+
+        words = line.split()
+        if words[0] in modules:
+            invocations.append(words)
+            continue
+
+        name, eq, value = line.partition('=')
+        if eq and re.match('^[A-Za-z_][A-Za-z0-9_]*$', name):
+            variables[name] = value.strip().strip('"\'')
+
+    return variables, invocations
+
+def get_used_modules(invocations):
+    """
+    Returns the names of the modules used by a list of invocations (obtained
+    with parse_master()), once each, in order of first use.
+    """
+    modules = []
+    seen = set()
+    for words in invocations:
+        if words[0] not in seen:
+            seen.add(words[0])
+            modules.append(words[0])
+
+    return modules
+
+def get_rendered_header(script, variables, key=''):
+    """
+    Returns the header of a rendered script: the environment defined by the
+    master script variables, the subject taken from the command line, the
+    subject and run locks, and the (opt-in) stage metrics.
+    """
+    from scriptuit import locks, metrics
+
+    datetime, user, f_id = get_date_user()
+
+    return ('#!/bin/bash\n\n'
+            '# rendered scriptuit from {script}\n'
+            '# generated: {datetime} by {user}.\n'
+            '# scriptuit key: {key}\n\n'
+            'set -e\n\n'
+            'export DIR_MODULES={DIR_MODULES}\n'
+            'export DIR_DATA={DIR_DATA}\n'
+            'export DIR_EXPT={DIR_EXPT}\n'
+            'export DATA_TYPE={DATA_TYPE}\n'
+            'export ID={ID}\n'
+            'export SUB=${{1}}\n\n'
+            'if [ -z ${{1}} ]; then\n'
+            '    echo "Usage:"\n'
+            '    echo "    $(basename ${{0}}) subject"\n'
+            '    exit 1\n'
+            'fi\n'
+            '{locks}{metrics}\n'.format(
+                script=script,
+                user=user,
+                datetime=datetime,
+                key=key,
+                locks=locks.get_rendered_locks(),
+                metrics=metrics.get_rendered_metrics(),
+                DIR_MODULES=variables['DIR_MODULES'],
+                DIR_DATA=variables['DIR_DATA'],
+                DIR_EXPT=variables['DIR_EXPT'],
+                DATA_TYPE=variables['DATA_TYPE'],
+                ID=variables['ID']))
+
+def is_named_by_id(body, prefix):
+    """
+    Returns True if a module body names the files of an output prefix by the
+    convention <prefix>.${ID}.<run>, the only files sit_purge removes.
+    """
+    pattern = re.compile(r'(^|[^\w]){}\.\$\{{?ID\}}?\.'.format(re.escape(prefix)))
+    return any(pattern.search(l) for l in body)
+
+def get_purge_schedule(invocations, dir_modules, keep=[]):
+    """
+    Returns a dict of invocation indices and the intermediate output prefixes
+    (output: and others:) that can be removed once that stage has finished:
+    those of each earlier stage that no later stage uses, either by taking
+    its output as an argument, or by naming its module or prefixes as a
+    prerequisite (prereq:). Final outputs (stages without downstream
+    consumers), the stages of modules in keep, and prefixes written by more
+    than one stage are never removed. Nor are prefixes whose files the module
+    does not name <prefix>.${ID}.*, since they could not be found (a warning
+    is printed).
+    """
+    def is_prereq(prereq, names):
+        for name in names:
+            try:
+                check_match(prereq, [name])
+                return True
+            except ValueError:
+                continue
+        return False
+
+    outputs, prereqs, bodies = [], [], {}
+    for words in invocations:
+        header = get_header(os.path.join(dir_modules, words[0]))
+        output = get_line(header, 'output:') or []
+        others = get_line(header, 'others:') or []
+        outputs.append([output[0] if output else None, output + others])
+        prereqs.append(get_line(header, 'prereq:') or [])
+        if words[0] not in bodies:
+            bodies[words[0]] = get_body(os.path.join(dir_modules, words[0]))
+
+    # prefixes written by more than one stage, or kept, are never removed
+    written = {}
+    for i, (output, prefixes) in enumerate(outputs):
+        for p in prefixes:
+            written[p] = written.get(p, 0) + 1
+    kept = set(p for i, (output, prefixes) in enumerate(outputs)
+                 if invocations[i][0] in keep for p in prefixes)
+
+    schedule = {}
+    for i, (output, prefixes) in enumerate(outputs):
+        if not output or invocations[i][0] in keep:
+            continue
+        names = [invocations[i][0]] + prefixes
+        consumers = [j for j in range(i+1, len(invocations))
+                       if output in invocations[j][1:] or
+                          any(is_prereq(r, names) for r in prereqs[j])]
+        if len(consumers) == 0:
+            continue
+
+        purge = []
+        for p in prefixes:
+            if written[p] > 1 or p in kept:
+                continue
+            if not is_named_by_id(bodies[invocations[i][0]], p):
+                print('WARNING: {} does not name its outputs {}.${{ID}}.*, '
+                      'so they are kept'.format(invocations[i][0], p))
+                continue
+            purge.append(p)
+        if purge:
+            schedule.setdefault(consumers[-1], []).extend(purge)
+
+    return schedule
+
+def get_rendered_purge(placeholders=False):
+    """
+    Returns the BASH function that removes this ID's files with the given
+    prefixes from the subject's modality and session folders (RUN folders are
+    never touched), optionally leaving empty placeholders behind.
+    """
+    return ('\n# remove intermediate outputs once every downstream stage has finished\n'
+            'sit_purge() {{\n'
+            '    local dir_mode=${{DIR_DATA}}/${{DIR_EXPT}}/${{SUB}}/${{DATA_TYPE}}\n'
+            '    for prefix in "$@"; do\n'
+            '        for f in $(find ${{dir_mode}} -maxdepth 2 -type f -name "${{prefix}}.${{ID}}.*"); do\n'
+            '            rm ${{f}}\n'
+            '{placeholder}'
+            '        done\n'
+            '    done\n'
+            '}}\n'.format(placeholder='            touch ${f}\n' if placeholders else ''))
+
+def get_rendered_stages(invocations, dir_modules, purge={}, placeholders=False):
+    """
+    Returns the lines of each module body (read once per module, however many
+    times it is invoked) in order, with the command-line arguments of each
+    invocation hard coded. Each stage is timed (see get_rendered_metrics()).
+
+    purge is a dict of invocation indices and the prefixes to remove after
+    that stage (obtained with get_purge_schedule()).
+    """
+    bodies = {}
+    for m in get_used_modules(invocations):
+        bodies[m] = get_body(os.path.join(dir_modules, m))
+
+    lines = []
+    if purge:
+        lines.append(get_rendered_purge(placeholders))
+
+    for i, words in enumerate(invocations):
+        lines.append('\nsit_begin {}\n'.format(words[0]))
+        lines.extend(get_rendered_module(list(bodies[words[0]]), ' '.join(words)))
+        lines.append('\nsit_end\n')
+        if i in purge:
+            lines.append('sit_purge {}\n'.format(' '.join(purge[i])))
+
+    return lines
+
+def get_render_key(script, modules):
+    """
+    Returns a key identifying a rendered script: a hash of the master script,
+    the full contents of each module it uses (in order), the scriptuit
+    version, and the source of the scriptuit modules that write rendered
+    scripts (header, locks, metrics and stages). If any of these change, so
+    does the key.
+    """
+    import hashlib
+    from scriptuit import __version__, locks, metrics
+
+    # the rendering code itself, so scripts rendered by older code are redone
+    sources = []
+    for m in [sys.modules[__name__], locks, metrics]:
+        source = os.path.splitext(m.__file__)[0] + '.py'
+        sources.append(source if os.path.isfile(source) else m.__file__)
+
+    key = hashlib.sha1(__version__)
+    for filename in sources + [script] + modules:
+        f = open(filename, 'rb')
+        key.update(hashlib.sha1(f.read()).hexdigest())
+        f.close()
+
+    return key.hexdigest()
+
+def get_rendered_key(filename):
+    """
+    Returns the key written into the header of a rendered script, or None if
+    the file does not exist or has no key.
+    """
+    if not os.path.isfile(filename):
+        return None
+
+    f = open(filename, 'rb')
+    for l in f:
+        if l.startswith('# scriptuit key: '):
+            f.close()
+            return l.split(':')[1].strip()
+        if not l.startswith('#') and l.strip() != '':
+            break
+    f.close()
+
+    return None
+
 def get_opts(header, args):
     """
     Returns the options for the module as a list of lists.
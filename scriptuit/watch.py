@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Watches an experiment for newly arrived subjects. Changes wake the watcher via
+inotify (through ctypes, on Linux), or it falls back to polling. A subject is
+ready once the RUN folders of an image modality each hold one valid NIFTI and
+have been left unchanged for a settle period, so subjects still being copied
+from the scanner are never dispatched.
+
+What has been dispatched is recorded in the experiment's .scriptuit folder, so
+a restarted watcher does not dispatch subjects twice.
+"""
+
+import os
+import time
+import errno
+import select
+
+from scriptuit import nifti
+
+# inotify event mask: anything that changes the contents of a folder
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+        IN_CREATE | IN_DELETE)
+
+class Watcher(object):
+    """
+    Waits for changes in a set of folders. Uses inotify if the C library
+    provides it, otherwise wait() simply sleeps (and callers rescan).
+    """
+    def __init__(self):
+        self.fd = None
+        self.watched = set()
+        try:
+            import ctypes, ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                               use_errno=True)
+            fd = libc.inotify_init()
+            if fd >= 0:
+                self.libc, self.fd = libc, fd
+        except (OSError, AttributeError):
+            pass
+
+    def add(self, path):
+        """
+        Watches a folder (once). Returns False if it could not be watched.
+        """
+        if self.fd is None:
+            return False
+        if path in self.watched:
+            return True
+        if self.libc.inotify_add_watch(self.fd, path, MASK) < 0:
+            return False
+        self.watched.add(path)
+        return True
+
+    def wait(self, timeout):
+        """
+        Blocks until a watched folder changes or timeout seconds pass. Returns
+        True if a change was seen. Pending events are discarded, since the
+        caller rescans the subjects anyway.
+        """
+        if self.fd is None:
+            time.sleep(timeout)
+            return False
+
+        try:
+            ready = select.select([self.fd], [], [], timeout)[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return False
+            raise
+        if not ready:
+            return False
+
+        while select.select([self.fd], [], [], 0)[0]:
+            os.read(self.fd, 65536)
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+def get_runs(dir_subj, mode):
+    """
+    Returns the folders of a subject's image modality (the modality, session
+    and RUN folders) and, for each RUN folder, the NIFTI files within it.
+    """
+    folders, runs = [], []
+    dir_mode = os.path.join(dir_subj, mode)
+    if not os.path.isdir(dir_mode):
+        return folders, runs
+
+    folders.append(dir_mode)
+    for sess in sorted(os.listdir(dir_mode)):
+        dir_sess = os.path.join(dir_mode, sess)
+        if not sess.startswith('SESS') or not os.path.isdir(dir_sess):
+            continue
+        folders.append(dir_sess)
+
+        for run in sorted(os.listdir(dir_sess)):
+            dir_run = os.path.join(dir_sess, run)
+            if not run.startswith('RUN') or not os.path.isdir(dir_run):
+                continue
+            folders.append(dir_run)
+            runs.append([os.path.join(dir_run, f) for f in sorted(os.listdir(dir_run))
+                                  if f.endswith('.nii') or f.endswith('.nii.gz')])
+
+    return folders, runs
+
+def get_signature(dir_subj, mode):
+    """
+    Returns the size and mtime of every file in a subject's RUN folders
+    (changes while data is still arriving), and the newest of those mtimes.
+    """
+    signature, newest = [], 0
+    for dir_run in get_runs(dir_subj, mode)[0]:
+        if not os.path.basename(dir_run).startswith('RUN'):
+            continue
+        for f in sorted(os.listdir(dir_run)):
+            try:
+                st = os.stat(os.path.join(dir_run, f))
+            except OSError:
+                continue # removed since listed
+            signature.append([os.path.join(dir_run, f), st.st_size, st.st_mtime])
+            newest = max(newest, st.st_mtime)
+
+    return signature, newest
+
+def check_subject(dir_subj, mode, cache_file=None):
+    """
+    Returns None if every RUN folder of a subject's image modality holds
+    exactly one valid NIFTI, otherwise the reason the subject is not ready.
+    """
+    runs = get_runs(dir_subj, mode)[1]
+    if len(runs) == 0:
+        return 'no RUN folders in {}'.format(mode)
+
+    for files in runs:
+        if len(files) != 1:
+            return '{} NIFTI files in a RUN folder'.format(len(files))
+
+    problems = nifti.check_files([files[0] for files in runs], cache_file)
+    for f in sorted(problems):
+        if problems[f]:
+            return 'invalid NIFTI {}: {}'.format(os.path.basename(f), problems[f])
+
+    return None
+
+def read_record(filename):
+    """
+    Returns the record of dispatched subjects stored in filename, or an empty
+    record.
+    """
+    return nifti.read_cache(filename)
+
+def write_record(filename, record):
+    """
+    Writes the record of dispatched subjects, replacing it in one step.
+    """
+    nifti.write_cache(filename, record)
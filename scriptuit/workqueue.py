@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""
+A work queue kept in a folder on a shared filesystem, for running proclist
+commands on several nodes without a scheduler. Each task is a file holding a
+command, and moves between the pending, claimed, done and failed folders.
+
+Tasks are claimed with os.rename, which is atomic, so a task is only ever
+claimed by one worker. Claimed tasks are named <task>@<worker>, and each
+worker touches its file in the workers folder while it runs. Any worker that
+finds a claimed task whose owner has stopped touching its file requeues it.
+
+Task files keep a history after the command (one line per event), e.g.,
+
+    /data/cmd_ID.sh subj01
+    claimed    node01.1234    1500000000.0
+    exit       0              812.5          node01.1234
+"""
+
+import os
+import time
+import errno
+import socket
+import subprocess
+
+from scriptuit import jobs
+
+FOLDERS = ['pending', 'claimed', 'done', 'failed', 'workers', 'logs', 'tmp']
+
+def init(queue):
+    """
+    Creates the queue's folders, if required.
+    """
+    for d in FOLDERS:
+        path = os.path.join(queue, d)
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+
+def get_worker_id():
+    """
+    Returns the name of this worker: its host name and process ID.
+    """
+    return '{}.{}'.format(socket.gethostname().split('.')[0], os.getpid())
+
+def append(filename, *fields):
+    """
+    Adds an event to a task's history.
+    """
+    f = open(filename, 'ab')
+    f.write('\t'.join(str(x) for x in fields) + '\n')
+    f.close()
+
+def read_task(filename):
+    """
+    Returns the command of a task, and its history as a list of events.
+    """
+    lines = open(filename).read().splitlines()
+    return lines[0], [line.split('\t') for line in lines[1:]]
+
+def get_attempts(history):
+    """
+    Returns the number of times a task has been claimed since it was last
+    returned to the queue by retry_failed().
+    """
+    attempts = 0
+    for event in history:
+        if event[0] == 'retry':
+            attempts = 0
+        elif event[0] == 'claimed':
+            attempts += 1
+
+    return attempts
+
+def enqueue(queue, commands):
+    """
+    Adds each command to the queue as a new task, in order. Tasks are written
+    outside the pending folder first, so workers never see partial tasks.
+    Returns the names of the tasks.
+    """
+    init(queue)
+    stamp, u_id = int(time.time()), jobs.get_uid()
+
+    names = []
+    for i, command in enumerate(commands):
+        subject = jobs.get_subject(command) or 'task'
+        name = '{}-{}-{:05d}-{}'.format(stamp, u_id, i, subject.replace('/', '_'))
+        tmp = os.path.join(queue, 'tmp', name)
+        f = open(tmp, 'wb')
+        f.write(command.strip() + '\n')
+        f.close()
+        os.rename(tmp, os.path.join(queue, 'pending', name))
+        names.append(name)
+
+    return names
+
+def heartbeat(queue, worker):
+    """
+    Marks a worker as alive.
+    """
+    f = open(os.path.join(queue, 'workers', worker), 'ab')
+    f.close()
+    os.utime(os.path.join(queue, 'workers', worker), None)
+
+def claim(queue, worker):
+    """
+    Claims the oldest pending task. Returns its name, or None if there are no
+    pending tasks.
+    """
+    for name in sorted(os.listdir(os.path.join(queue, 'pending'))):
+        claimed = os.path.join(queue, 'claimed', '{}@{}'.format(name, worker))
+        try:
+            os.rename(os.path.join(queue, 'pending', name), claimed)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                continue # claimed by another worker first
+            raise
+        append(claimed, 'claimed', worker, time.time())
+        return name
+
+    return None
+
+def finish(queue, name, worker, rc, duration):
+    """
+    Records the exit status of a claimed task, and moves it to done or
+    failed. Returns False if the task was requeued while it ran (i.e., this
+    worker was thought dead).
+    """
+    claimed = os.path.join(queue, 'claimed', '{}@{}'.format(name, worker))
+    try:
+        os.rename(claimed, os.path.join(queue, 'tmp', name))
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return False
+        raise
+
+    append(os.path.join(queue, 'tmp', name), 'exit', rc, duration, worker)
+    os.rename(os.path.join(queue, 'tmp', name),
+              os.path.join(queue, 'done' if rc == 0 else 'failed', name))
+
+    return True
+
+def requeue_dead(queue, timeout, max_attempts=3):
+    """
+    Returns the tasks claimed by workers that have not sent a heartbeat in
+    timeout seconds to the pending folder, or to the failed folder once they
+    have been claimed max_attempts times (since they were last retried).
+    Returns the names of the tasks moved.
+    """
+    now = time.time()
+    moved = []
+
+    for claimed in sorted(os.listdir(os.path.join(queue, 'claimed'))):
+        name, owner = claimed.rsplit('@', 1)
+        try:
+            alive = now - os.stat(os.path.join(queue, 'workers', owner)).st_mtime < timeout
+        except OSError:
+            alive = False
+        if alive:
+            continue
+
+        # only one worker wins the rename, and requeues the task
+        tmp = os.path.join(queue, 'tmp', name)
+        try:
+            os.rename(os.path.join(queue, 'claimed', claimed), tmp)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                continue
+            raise
+
+        append(tmp, 'requeued', owner, now)
+        command, history = read_task(tmp)
+        target = 'failed' if get_attempts(history) >= max_attempts else 'pending'
+        os.rename(tmp, os.path.join(queue, target, name))
+        moved.append(name)
+
+    return moved
+
+def retry_failed(queue):
+    """
+    Returns every failed task to the pending folder, with a fresh count of
+    attempts. Returns their names.
+    """
+    names = sorted(os.listdir(os.path.join(queue, 'failed')))
+    for name in names:
+        append(os.path.join(queue, 'failed', name), 'retry', '', time.time())
+        os.rename(os.path.join(queue, 'failed', name),
+                  os.path.join(queue, 'pending', name))
+
+    return names
+
+def run(queue, name, worker, interval=30, history=jobs.HISTORY):
+    """
+    Runs a claimed task, logging to the queue's logs folder, and sends a
+    heartbeat every interval seconds while it runs. The durations of
+    successful tasks are added to the history file read by sit-queue,
+    sit-listsubj and scriptuit estimate. Returns the exit code and duration of
+    the task.
+    """
+    claimed = os.path.join(queue, 'claimed', '{}@{}'.format(name, worker))
+    command = read_task(claimed)[0]
+
+    log = open(os.path.join(queue, 'logs', name), 'ab')
+    start = time.time()
+    proc = subprocess.Popen(command, shell=True, executable='/bin/bash',
+                                     stdout=log, stderr=subprocess.STDOUT)
+
+    # poll quickly at first, so short tasks are not held up
+    last, wait = start, 0.05
+    while proc.poll() is None:
+        time.sleep(wait)
+        wait = min(wait * 2, 1)
+        if time.time() - last >= interval:
+            heartbeat(queue, worker)
+            last = time.time()
+
+    duration = time.time() - start
+    log.write('scriptuit: exit {}\n'.format(proc.returncode))
+    log.close()
+
+    if proc.returncode == 0:
+        jobs.write_history([[0, 0, duration, command, start]], history)
+
+    return proc.returncode, duration
+
+def get_status(queue, timeout):
+    """
+    Returns the number of tasks in each folder, and the workers that have
+    sent a heartbeat in the last timeout seconds.
+    """
+    counts = dict((d, len(os.listdir(os.path.join(queue, d))))
+                       for d in ['pending', 'claimed', 'done', 'failed'])
+
+    now = time.time()
+    workers = []
+    for w in sorted(os.listdir(os.path.join(queue, 'workers'))):
+        try:
+            if now - os.stat(os.path.join(queue, 'workers', w)).st_mtime < timeout:
+                workers.append(w)
+        except OSError:
+            continue
+
+    return counts, workers
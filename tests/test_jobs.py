@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Tests for the bundling helpers in scriptuit.jobs.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from scriptuit import jobs
+
+def write(filename, text):
+    f = open(filename, 'wb')
+    f.write(text)
+    f.close()
+
+class TestBundles(unittest.TestCase):
+
+    def setUp(self):
+        self.commands = ['/data/cmd_ID.sh S{}'.format(i) for i in range(7)]
+        self.history = {'cmd_ID.sh': [600.0]}
+
+    def test_bundles_fit_walltime(self):
+        bundles = jobs.get_bundles(self.commands, self.history, 1500, 60, n_procs=2)
+        self.assertEqual([len(b) for b in bundles], [4, 3])
+        self.assertEqual(sum(bundles, []), self.commands)
+        for bundle in bundles:
+            self.assertTrue(jobs.get_bundle_duration(bundle, self.history, 60, 2) <= 1500)
+
+    def test_makespan_not_lower_bound(self):
+        # 3 commands on 2 procs take 2 rounds, not 1.5
+        self.assertEqual(jobs.get_bundle_duration(self.commands[:3], self.history, 60, 2), 1200)
+        bundles = jobs.get_bundles(self.commands[:3], self.history, 1000, 60, n_procs=2)
+        self.assertEqual([len(b) for b in bundles], [2, 1])
+
+    def test_long_command_bundled_alone(self):
+        bundles = jobs.get_bundles(self.commands[:2], self.history, 60, 60)
+        self.assertEqual(bundles, [[c] for c in self.commands[:2]])
+
+    def test_default_without_history(self):
+        bundles = jobs.get_bundles(self.commands, {}, 180, 60)
+        self.assertEqual([len(b) for b in bundles], [3, 3, 1])
+
+    def test_walltime_margin(self):
+        self.assertEqual(jobs.get_walltime(self.commands[:4], self.history, 1500, 60, 2),
+                         1500 * jobs.MARGIN)
+        self.assertEqual(jobs.get_walltime(self.commands[:4], self.history, 600, 60, 2),
+                         1200 * jobs.MARGIN)
+
+class TestFailed(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_jobs = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_jobs)
+
+    def write_bundle(self, name, commands, status, mtime):
+        write(os.path.join(self.dir_jobs, name + '.commands'),
+              ''.join(c + '\n' for c in commands))
+        filename = os.path.join(self.dir_jobs, name + '.status')
+        write(filename, ''.join('\t'.join(str(x) for x in r) + '\n' for r in status))
+        os.utime(filename, (mtime, mtime))
+
+    def test_latest_record_wins(self):
+        self.write_bundle('b_0', ['a S1', 'a S2', 'a S3'],
+                          [[0, 1, 5.0, 'a S1'], [1, 0, 5.0, 'a S2']], 1000)
+        self.write_bundle('b_0_r1', ['a S1', 'a S3'],
+                          [[0, 0, 5.0, 'a S1'], [1, 1, 5.0, 'a S3']], 2000)
+        self.assertEqual(jobs.get_failed(self.dir_jobs), ['a S3'])
+
+    def test_unreported_commands_fail(self):
+        self.write_bundle('b_0', ['a S1', 'a S2'], [[0, 0, 5.0, 'a S1']], 1000)
+        self.assertEqual(jobs.get_failed(self.dir_jobs), ['a S2'])
+
+    def test_failed_once(self):
+        self.write_bundle('b_0', ['a S1'], [[0, 1, 5.0, 'a S1']], 1000)
+        self.write_bundle('b_0_r1', ['a S1'], [[0, 1, 5.0, 'a S1']], 2000)
+        self.assertEqual(jobs.get_failed(self.dir_jobs), ['a S1'])
+
+    def test_no_jobs(self):
+        self.assertEqual(jobs.get_failed(os.path.join(self.dir_jobs, 'missing')), [])
+
+if __name__ == '__main__':
+    unittest.main()
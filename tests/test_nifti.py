@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Tests for the NIFTI-1 header checks in scriptuit.nifti.
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+from scriptuit import nifti
+
+def get_nifti(dims=(4, 4, 4), datatype=4, bitpix=16, magic='n+1\0'):
+    """
+    Returns the bytes of a little-endian NIFTI-1 file with the given dims.
+    """
+    header = bytearray(nifti.HEADER_SIZE)
+    struct.pack_into('<i', header, 0, nifti.HEADER_SIZE)
+    struct.pack_into('<8h', header, 40, len(dims), *(list(dims) + [1] * (7 - len(dims))))
+    struct.pack_into('<2h', header, 70, datatype, bitpix)
+    struct.pack_into('<f', header, 108, 352.0)
+    header[344:348] = magic
+
+    n_voxels = 1
+    for d in dims:
+        n_voxels *= d
+    return str(header) + '\0' * 4 + '\1' * (n_voxels * bitpix / 8)
+
+def gzip(members):
+    """
+    Returns each string in members compressed as a gzip member, concatenated.
+    """
+    data = ''
+    for member in members:
+        c = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        data += c.compress(member) + c.flush()
+    return data
+
+class TestValidate(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def validate(self, name, data):
+        filename = os.path.join(self.directory, name)
+        f = open(filename, 'wb')
+        f.write(data)
+        f.close()
+        return nifti.validate(filename)
+
+    def test_valid(self):
+        self.assertEqual(self.validate('a.nii', get_nifti()), None)
+        self.assertEqual(self.validate('a.nii.gz', gzip([get_nifti()])), None)
+
+    def test_larger_than_expected(self):
+        self.assertEqual(self.validate('a.nii', get_nifti() + 'extension'), None)
+        self.assertEqual(self.validate('a.nii.gz', gzip([get_nifti() + 'extension'])), None)
+
+    def test_truncated(self):
+        data = get_nifti()[:-10]
+        self.assertTrue(self.validate('a.nii', data).startswith('truncated'))
+        self.assertTrue(self.validate('a.nii.gz', gzip([data])).startswith('truncated'))
+        self.assertEqual(self.validate('b.nii', data[:100]), 'truncated header')
+
+    def test_multi_member(self):
+        data = get_nifti()
+        self.assertEqual(self.validate('a.nii.gz', gzip([data[:400], data[400:]])), None)
+        self.assertTrue(self.validate('b.nii.gz', gzip([data[:400], data[400:-10]])
+                                      ).startswith('truncated'))
+
+    def test_corrupt_gzip(self):
+        self.assertEqual(self.validate('a.nii.gz', 'not gzip at all'), 'corrupt gzip stream')
+
+    def test_bad_header(self):
+        self.assertTrue(self.validate('a.nii', get_nifti(magic='ni1\0')).startswith('bad magic'))
+        self.assertTrue(self.validate('b.nii', get_nifti(dims=(4, 0, 4))).startswith('bad dims'))
+        self.assertTrue(self.validate('c.nii', get_nifti(datatype=3)).startswith('unknown'))
+        self.assertTrue(self.validate('d.nii', get_nifti(bitpix=8)).startswith('bitpix'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Tests for estimates, ordering and makespans in scriptuit.schedule.
+"""
+
+import unittest
+
+from scriptuit import schedule
+
+def get_inventory(subject, n_bytes):
+    return {'subject': subject, 'bytes': n_bytes}
+
+class TestSchedule(unittest.TestCase):
+
+    def test_median(self):
+        self.assertEqual(schedule.get_median([3, 1, 2]), 2)
+        self.assertEqual(schedule.get_median([4, 1, 2, 3]), 2.5)
+
+    def test_makespan(self):
+        durations = {'a': 4.0, 'b': 3.0, 'c': 3.0, 'd': 2.0}
+        self.assertEqual(schedule.get_makespan(['a', 'b', 'c', 'd'], durations, 1), 12.0)
+        self.assertEqual(schedule.get_makespan(['a', 'b', 'c', 'd'], durations, 2), 6.0)
+        self.assertEqual(schedule.get_makespan(['d', 'b', 'c', 'a'], durations, 2), 7.0)
+        self.assertEqual(schedule.get_makespan(['a', 'b'], durations, 8), 4.0)
+        self.assertEqual(schedule.get_makespan([], durations, 0), 0.0)
+
+    def test_order(self):
+        self.assertEqual(schedule.get_order({'a': 1.0, 'b': 2.0, 'c': 2.0}), ['b', 'c', 'a'])
+
+    def test_estimates_without_history(self):
+        inventories = [get_inventory('a', 100), get_inventory('b', 300), get_inventory('c', 0)]
+        estimates = schedule.get_estimates(inventories, {}, default=60.0)
+        self.assertEqual(estimates, {'a': 30.0, 'b': 90.0, 'c': 60.0})
+
+    def test_estimates_with_history(self):
+        inventories = [get_inventory('a', 100), get_inventory('b', 300)]
+        history = {'a': [10.0, 20.0, 30.0]}
+        self.assertEqual(schedule.get_estimates(inventories, history),
+                         {'a': 20.0, 'b': 60.0})
+        self.assertEqual(schedule.get_estimates(inventories, history, own=False),
+                         {'a': 20.0, 'b': 60.0})
+
+        history['a'] = [40.0]
+        self.assertEqual(schedule.get_estimates(inventories, history, own=False)['a'], 40.0)
+        history['b'] = [60.0]
+        self.assertEqual(schedule.get_estimates(inventories, history, own=False)['a'], 25.0)
+
+    def test_report(self):
+        inventories = [get_inventory(s, n) for s, n in [('a', 100), ('b', 100), ('c', 200)]]
+        rows = schedule.get_report(inventories, {}, 2, default=400.0)
+        self.assertEqual(rows, [['name', 900.0, None], ['longest-first', 600.0, None]])
+
+        history = {'a': [100.0], 'b': [100.0], 'c': [500.0]}
+        rows = schedule.get_report(inventories, history, 2)
+        self.assertEqual(rows, [['name', 525.0, 600.0], ['longest-first', 350.0, 500.0]])
+
+    def test_achieved(self):
+        times = {'a': [100.0, 200.0], 'b': [150.0, 400.0]}
+        self.assertEqual(schedule.get_achieved(times, ['a', 'b']), 300.0)
+        self.assertEqual(schedule.get_achieved(times, ['a', 'c']), None)
+        self.assertEqual(schedule.get_achieved(times, []), None)
+
+if __name__ == '__main__':
+    unittest.main()
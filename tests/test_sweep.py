@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Tests for grid parsing and the segment tree in scriptuit.sweep.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from scriptuit import sweep
+
+MODULES = {'init': 'init data_quality', 'smooth': 'smooth input fwhm', 'glm': 'glm input model'}
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_modules = tempfile.mkdtemp()
+        for module, usage in MODULES.items():
+            f = open(os.path.join(self.dir_modules, module), 'wb')
+            f.write('#!/bin/bash\n#\n# {}\n#\n# output: {}\n\necho\n'.format(usage, module))
+            f.close()
+        self.invocations = [['init', 'high'], ['smooth', 'init', '6'],
+                            ['glm', 'smooth', 'a'], ['smooth', 'glm', '4']]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_modules)
+
+    def parse(self, *specs):
+        return sweep.parse_grid(list(specs), self.invocations, self.dir_modules)
+
+    def get_segments(self, *specs):
+        variants = sweep.expand(self.invocations, self.parse(*specs))
+        return sweep.get_segments(variants, 'ID')
+
+    def test_parse_grid(self):
+        self.assertEqual(self.parse('smooth.fwhm=4,8'), [[1, 2, 'smooth.fwhm', ['4', '8']]])
+        self.assertEqual(self.parse('smooth:2.fwhm=2,'), [[3, 2, 'smooth:2.fwhm', ['2']]])
+        self.assertEqual(self.parse('glm.2=a,b'), [[2, 2, 'glm.2', ['a', 'b']]])
+
+    def test_parse_grid_errors(self):
+        for spec in ['smooth.fwhm', 'smooth:x.fwhm=4', 'smooth:3.fwhm=4', 'bet.f=1',
+                     'smooth.sigma=4', 'smooth.3=4', 'smooth.0=4']:
+            self.assertRaises(ValueError, self.parse, spec)
+
+    def test_no_grid(self):
+        segments = self.get_segments()
+        self.assertEqual(len(segments), 1)
+        self.assertEqual(segments[0]['id'], 'ID')
+        self.assertEqual(segments[0]['parent'], None)
+        self.assertEqual(segments[0]['stages'], self.invocations)
+        self.assertEqual(segments[0]['variants'], [[]])
+
+    def test_shared_prefix(self):
+        segments = self.get_segments('glm.model=a,b')
+        self.assertEqual(len(segments), 3)
+        self.assertEqual(segments[0]['stages'], self.invocations[:2])
+        self.assertEqual(segments[0]['variants'], [])
+        for segment, model in zip(segments[1:], ['a', 'b']):
+            self.assertEqual(segment['parent'], 'ID')
+            self.assertEqual(segment['stages'][0], ['glm', 'smooth', model])
+            self.assertEqual(segment['stages'][1], self.invocations[3])
+            self.assertEqual(segment['variants'], [['glm.model={}'.format(model)]])
+
+    def test_nested_branches(self):
+        segments = self.get_segments('smooth.fwhm=4,8', 'glm.model=a,b')
+        self.assertEqual(len(segments), 7)
+        self.assertEqual(sum(len(s['variants']) for s in segments), 4)
+
+        # parents run first, and every ID is distinct
+        seen = set()
+        for segment in segments:
+            self.assertTrue(segment['parent'] is None or segment['parent'] in seen)
+            seen.add(segment['id'])
+        self.assertEqual(len(seen), 7)
+
+        # each stage configuration is run once
+        stages = [' '.join(words) for s in segments for words in s['stages']]
+        self.assertEqual(stages.count('init high'), 1)
+        self.assertEqual(stages.count('smooth init 4'), 1)
+        self.assertEqual(stages.count('glm smooth a'), 2)
+
+    def test_ids_are_stable(self):
+        ids = [s['id'] for s in self.get_segments('smooth.fwhm=4,8')]
+        self.assertEqual(ids, [s['id'] for s in self.get_segments('smooth.fwhm=4,8')])
+
+if __name__ == '__main__':
+    unittest.main()
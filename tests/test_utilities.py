@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Tests for the purge schedule in scriptuit.utilities.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from scriptuit import utilities
+
+class TestPurgeSchedule(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_modules = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_modules)
+
+    def add_module(self, name, output, others='', prereq='', named=True):
+        body = ''.join('touch ${{DIR}}/{}.{}.01.nii.gz\n'.format(p, '${ID}' if named else 'x')
+                       for p in [output] + others.split())
+        f = open(os.path.join(self.dir_modules, name), 'wb')
+        f.write('#!/bin/bash\n#\n# {0} input\n#\n# output: {1}\n# others: {2}\n'
+                '# prereq: {3}\n\n{4}'.format(name, output, others, prereq, body))
+        f.close()
+
+    def get_schedule(self, invocations, keep=[]):
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            schedule = utilities.get_purge_schedule(invocations, self.dir_modules, keep)
+            return schedule, sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_chain(self):
+        self.add_module('a', 'a_out', others='a_params')
+        self.add_module('b', 'b_out')
+        self.add_module('c', 'c_out')
+        schedule, warnings = self.get_schedule([['a', 'x'], ['b', 'a_out'], ['c', 'b_out']])
+        self.assertEqual(schedule, {1: ['a_out', 'a_params'], 2: ['b_out']})
+        self.assertEqual(warnings, '')
+
+    def test_last_consumer(self):
+        self.add_module('a', 'a_out')
+        self.add_module('b', 'b_out')
+        self.add_module('c', 'c_out')
+        schedule, warnings = self.get_schedule([['a', 'x'], ['b', 'a_out'], ['c', 'a_out']])
+        self.assertEqual(schedule, {2: ['a_out']})
+
+    def test_prereq_consumer(self):
+        self.add_module('init_a', 'a_out')
+        self.add_module('b', 'b_out')
+        self.add_module('c', 'c_out', prereq='init_*')
+        schedule, warnings = self.get_schedule([['init_a', 'x'], ['b', 'a_out'], ['c', 'b_out']])
+        self.assertEqual(schedule, {2: ['a_out', 'b_out']})
+
+    def test_kept(self):
+        self.add_module('a', 'a_out')
+        self.add_module('b', 'b_out')
+        self.add_module('c', 'c_out')
+        schedule, warnings = self.get_schedule([['a', 'x'], ['b', 'a_out'], ['c', 'b_out']],
+                                               keep=['a'])
+        self.assertEqual(schedule, {2: ['b_out']})
+
+    def test_written_twice(self):
+        self.add_module('a', 'a_out')
+        self.add_module('b', 'b_out')
+        schedule, warnings = self.get_schedule([['a', 'x'], ['b', 'a_out'], ['a', 'b_out'],
+                                                ['b', 'a_out']])
+        self.assertEqual(schedule, {})
+
+    def test_not_named_by_id(self):
+        self.add_module('a', 'a_out', named=False)
+        self.add_module('b', 'b_out')
+        schedule, warnings = self.get_schedule([['a', 'x'], ['b', 'a_out']])
+        self.assertEqual(schedule, {})
+        self.assertTrue(warnings.startswith('WARNING: a does not name its outputs a_out'))
+
+    def test_final_outputs_kept(self):
+        self.add_module('a', 'a_out')
+        self.add_module('b', 'b_out')
+        schedule, warnings = self.get_schedule([['a', 'x'], ['b', 'x']])
+        self.assertEqual(schedule, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Tests for claiming and requeueing tasks in scriptuit.workqueue.
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from scriptuit import workqueue
+
+class TestWorkQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = tempfile.mkdtemp()
+        self.names = workqueue.enqueue(self.queue, ['true S1', 'false S2'])
+
+    def tearDown(self):
+        shutil.rmtree(self.queue)
+
+    def listdir(self, folder):
+        return sorted(os.listdir(os.path.join(self.queue, folder)))
+
+    def kill(self, worker):
+        """
+        Makes a worker's last heartbeat an hour old.
+        """
+        filename = os.path.join(self.queue, 'workers', worker)
+        then = time.time() - 3600
+        os.utime(filename, (then, then))
+
+    def test_claim_in_order(self):
+        self.assertEqual(workqueue.claim(self.queue, 'w1'), self.names[0])
+        self.assertEqual(workqueue.claim(self.queue, 'w2'), self.names[1])
+        self.assertEqual(workqueue.claim(self.queue, 'w3'), None)
+        self.assertEqual(self.listdir('claimed'), ['{}@w1'.format(self.names[0]),
+                                                   '{}@w2'.format(self.names[1])])
+
+    def test_finish(self):
+        history = os.path.join(self.queue, 'history')
+        for worker in ['w1', 'w2']:
+            name = workqueue.claim(self.queue, worker)
+            rc, duration = workqueue.run(self.queue, name, worker, history=history)
+            self.assertTrue(workqueue.finish(self.queue, name, worker, rc, duration))
+        self.assertEqual(self.listdir('done'), self.names[:1])
+        self.assertEqual(self.listdir('failed'), self.names[1:])
+        self.assertEqual(open(history).read().split('\t')[0], 'true')
+
+    def test_requeue_dead(self):
+        name = workqueue.claim(self.queue, 'w1')
+        workqueue.heartbeat(self.queue, 'w1')
+        self.assertEqual(workqueue.requeue_dead(self.queue, 60), [])
+
+        self.kill('w1')
+        self.assertEqual(workqueue.requeue_dead(self.queue, 60), [name])
+        self.assertEqual(self.listdir('pending'), self.names)
+        self.assertFalse(workqueue.finish(self.queue, name, 'w1', 0, 1.0))
+
+    def test_attempts(self):
+        for i in range(2):
+            name = workqueue.claim(self.queue, 'w1')
+            self.assertEqual(workqueue.requeue_dead(self.queue, 60, max_attempts=2), [name])
+        self.assertEqual(self.listdir('failed'), [name])
+
+        # retried tasks start counting again
+        self.assertEqual(workqueue.retry_failed(self.queue), [name])
+        self.assertEqual(workqueue.claim(self.queue, 'w1'), name)
+        workqueue.requeue_dead(self.queue, 60, max_attempts=2)
+        self.assertEqual(self.listdir('pending'), self.names)
+
+    def test_get_attempts(self):
+        history = [['claimed'], ['requeued'], ['claimed'], ['retry'], ['claimed']]
+        self.assertEqual(workqueue.get_attempts(history), 1)
+        self.assertEqual(workqueue.get_attempts([]), 0)
+
+if __name__ == '__main__':
+    unittest.main()